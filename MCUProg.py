@@ -2,6 +2,7 @@
 import os
 import re
 import sys
+import threading
 import collections
 import configparser
 
@@ -11,6 +12,7 @@ from PyQt5.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog
 
 import jlink
 import xlink
+import firmware
 import device
 import device.chip
 
@@ -41,12 +43,13 @@ class MCUProg(QWidget):
         self.resize(self.width(), 160)
         self.table.horizontalHeader().setStretchLastSection(True)
 
+        self.devices = {}   # 不带 xlink 的 Chip 对象，用于获取 CHIP_SIZE、SECT_SIZE 等信息
+
         self.initSetting()
 
-        self.tmrDAP = QtCore.QTimer()
-        self.tmrDAP.setInterval(1000)
-        self.tmrDAP.timeout.connect(self.on_tmrDAP_timeout)
-        self.tmrDAP.start()
+        self.thrDAP = ThreadDAP([daplink.unique_id for daplink in self.daplinks])
+        self.thrDAP.probesChanged.connect(self.on_thrDAP_probesChanged)
+        self.thrDAP.start()
 
     def initSetting(self):
         if not os.path.exists('setting.ini'):
@@ -63,14 +66,19 @@ class MCUProg(QWidget):
             self.conf.set('link', 'select', '')
 
         self.cmbMode.setCurrentIndex(zero_if(self.cmbMode.findText(self.conf.get('link', 'mode'))))
-        self.cmbSpeed.setCurrentIndex(zero_if(self.cmbSpeed.findText(self.conf.get('link', 'speed'))))
 
         self.cmbDLL.addItem(self.conf.get('link', 'jlink'), 'jlink')
         self.cmbDLL.addItem('OpenOCD Tcl RPC (6666)', 'openocd')
-        self.on_tmrDAP_timeout()    # add DAPLink
+        self.set_daplinks(daplinks())    # add DAPLink
 
         self.cmbDLL.setCurrentIndex(zero_if(self.cmbDLL.findText(self.conf.get('link', 'select'))))
 
+        self.cmbSpeed.setCurrentIndex(zero_if(self.cmbSpeed.findText(self.conf.get('link', 'speed'))))
+        self.on_cmbDLL_currentIndexChanged(self.cmbDLL.currentIndex())
+
+        if not self.conf.has_section('speed'):      # Auto 模式下测得的时钟，键为 "调试器序列号@芯片型号"
+            self.conf.add_section('speed')
+
         if not self.conf.has_section('target'):
             self.conf.add_section('target')
             self.conf.set('target', 'mcu',  'NUM480')
@@ -87,6 +95,8 @@ class MCUProg(QWidget):
         
         self.cmbHEX.addItems(eval(self.conf.get('target', 'hexpath')))
 
+        self.chkIncr.setChecked(self.conf.getboolean('target', 'incremental', fallback=False))
+
         self.savPath = self.conf.get('target', 'savpath')
     
     def parse_devices(self):
@@ -114,75 +124,120 @@ class MCUProg(QWidget):
 
         return device.Devices.keys()
 
-    def on_tmrDAP_timeout(self):
-        if not self.isEnabled():    # link working
+    def on_thrDAP_probesChanged(self, probes):
+        if self.thrDAP.paused:  # 连接前已发出、排队中的信号：连接使用中不更新列表，断开后重新枚举
+            self.thrDAP.retry()
             return
 
-        try:
-            from pyocd.probe import aggregator
-            self.daplinks = aggregator.DebugProbeAggregator.get_all_connected_probes()
-        except Exception as e:
-            self.daplinks = []
+        self.set_daplinks(probes)
+
+    def set_daplinks(self, probes):
+        self.daplinks = probes
+
+        select = self.cmbDLL.currentText()
+
+        self.cmbDLL.blockSignals(True)      # 重建列表时选中项会临时变化，不要因此改掉 Auto 时钟
+
+        for i in range(2, self.cmbDLL.count()):
+            self.cmbDLL.removeItem(2)
+
+        for i, daplink in enumerate(self.daplinks):
+            self.cmbDLL.addItem(f'{daplink.product_name} ({daplink.unique_id})', i)
 
-        if len(self.daplinks) != self.cmbDLL.count() - 2:
-            for i in range(2, self.cmbDLL.count()):
-                self.cmbDLL.removeItem(2)
+        if self.cmbDLL.findText(select) != -1:
+            self.cmbDLL.setCurrentIndex(self.cmbDLL.findText(select))
 
-            for i, daplink in enumerate(self.daplinks):
-                self.cmbDLL.addItem(f'{daplink.product_name} ({daplink.unique_id})', i)
+        self.cmbDLL.blockSignals(False)
+
+        self.on_cmbDLL_currentIndexChanged(self.cmbDLL.currentIndex())
 
     def device(self, name, xlink):
         dev = device.Devices[name]
 
+        if not xlink and (name, dev) in self.devices:
+            return self.devices[(name, dev)]
+
         if isinstance(dev, tuple):
-            return device.chip.Chip(xlink, dev)
+            chip = device.chip.Chip(xlink, dev)
 
         else:
-            return dev(xlink)
+            chip = dev(xlink)
+
+        if not xlink:
+            self.devices[(name, dev)] = chip
+
+        return chip
 
     def link_open(self):
         mode = self.cmbMode.currentText()
         mode = mode.replace('RISC-V', 'RV').replace(' SWD', '').replace(' cJTAG', '').replace(' JTAG', 'J').lower()
         core = self.device(self.cmbMCU.currentText(), None).CHIP_CORE
-        speed= int(self.cmbSpeed.currentText().split()[0]) * 1000 # KHz
+        if self.cmbSpeed.currentText() == 'Auto':
+            speed = 0
+        else:
+            speed = int(self.cmbSpeed.currentText().split()[0]) * 1000 # KHz
+        speed_key = None
+
+        self.thrDAP.pause()     # 连接使用中不枚举调试器，以免和传输冲突
         try:
             item_data = self.cmbDLL.currentData()
 
             if item_data == 'jlink':
-                self.xlk = xlink.XLink(jlink.JLink(self.cmbDLL.currentText(), mode, core, speed))
+                self.xlk = xlink.XLink(jlink.JLink(self.cmbDLL.currentText(), mode, core, speed or 4000))
 
             elif item_data == 'openocd':
                 import openocd
-                self.xlk = xlink.XLink(openocd.OpenOCD(mode=mode, core=core, speed=speed))
+                self.xlk = xlink.XLink(openocd.OpenOCD(mode=mode, core=core, speed=speed or 4000))
 
             else:
                 from pyocd.coresight import dap, ap, cortex_m
                 daplink = self.daplinks[item_data]
                 daplink.open()
 
+                speed_key = f'{daplink.unique_id}@{self.cmbMCU.currentText()}'
+                if not speed:
+                    speed = self.conf.getint('speed', speed_key, fallback=0)
+
                 _dp = dap.DebugPort(daplink, None)
                 _dp.init()
                 _dp.power_up_debug()
-                _dp.set_clock(speed * 1000)
+                if speed:
+                    _dp.set_clock(speed * 1000)
 
                 _ap = ap.AHB_AP(_dp, 0)
                 _ap.init()
 
                 self.xlk = xlink.XLink(cortex_m.CortexM(None, _ap))
 
+                if not speed:   # 从最低时钟开始逐档提高，找出当前接线能可靠工作的最高时钟
+                    chip = self.device(self.cmbMCU.currentText(), None)
+                    speeds = [int(self.cmbSpeed.itemText(i).split()[0]) * 1000 for i in range(self.cmbSpeed.count())
+                                                                               if self.cmbSpeed.itemText(i) != 'Auto']
+                    speed = self.xlk.tune_speed(chip.PAGE_BUFF[0], min(chip.PAGE_SIZE, 1024), speeds)
+
+                    self.conf.set('speed', speed_key, str(speed))
+
             self.dev = self.device(self.cmbMCU.currentText(), self.xlk)
 
         except Exception as e:
+            if self.cmbSpeed.currentText() == 'Auto' and speed_key:
+                self.conf.remove_option('speed', speed_key)    # 保存的时钟可能已不可靠（换了接线等），下次重新测
             QMessageBox.critical(self, '连接失败', str(e), QMessageBox.Yes)
 
+            self.thrDAP.resume()
+
             return False
 
         return True
 
     def link_close(self):
-        self.xlk.reset()
+        try:
+            self.xlk.reset()
+
+            self.xlk.close()
 
-        self.xlk.close()
+        finally:
+            self.thrDAP.resume()
 
     @pyqtSlot()
     def on_btnChipErase_clicked(self):
@@ -205,7 +260,10 @@ class MCUProg(QWidget):
             self.threadErase.start()
         
     def on_btnErase_finished(self):
-        QMessageBox.information(self, '擦除完成', '        芯片擦除完成        ', QMessageBox.Yes)
+        if self.threadErase.error:
+            QMessageBox.critical(self, '擦除失败', self.threadErase.error, QMessageBox.Yes)
+        else:
+            QMessageBox.information(self, '擦除完成', '        芯片擦除完成        ', QMessageBox.Yes)
 
         self.link_close()
 
@@ -214,17 +272,14 @@ class MCUProg(QWidget):
 
     @pyqtSlot()
     def on_btnWrite_clicked(self):
-        if self.link_open():
-            self.setEnabled(False)
-            self.prgInfo.setVisible(True)
-
-            fpath = self.cmbHEX.currentText()
-            if not os.path.exists(fpath):
-                QMessageBox.warning(self, '文件不存在', fpath, QMessageBox.Yes)
-                return
+        fpath = self.cmbHEX.currentText()
+        if not os.path.exists(fpath):
+            QMessageBox.warning(self, '文件不存在', fpath, QMessageBox.Yes)
+            return
 
-            if fpath.endswith('.ini'):
-                self.wrdata = []
+        try:
+            if fpath.endswith('.ini'):  # 所有文件合并成一个镜像，一次擦除、烧写、校验
+                image = firmware.Image()
                 for i in range(self.table.rowCount()):
                     if self.table.item(i, 0).checkState():
                         fpath = self.table.item(i, 2).text()
@@ -232,32 +287,37 @@ class MCUProg(QWidget):
                             QMessageBox.warning(self, '文件不存在', fpath, QMessageBox.Yes)
                             return
 
-                        addr = int(self.table.item(i, 1).text(), 16) - self.dev.CHIP_BASE
+                        addr = int(self.table.item(i, 1).text(), 16) - self.device(self.cmbMCU.currentText(), None).CHIP_BASE
 
-                        if fpath.endswith('.hex'):
-                            self.wrdata.append((addr, parseHex(fpath)))
-
-                        else:
-                            self.wrdata.append((addr, open(fpath, 'rb').read()))
-            
-            elif fpath.endswith('.hex'):
-                self.wrdata = [(self.addr, parseHex(fpath))]
+                        try:
+                            image.merge(loadImage(fpath, addr))
+                        except Exception as e:
+                            raise Exception(f'{os.path.basename(fpath)}: {e}')
 
             else:
-                self.wrdata = [(self.addr, open(fpath, 'rb').read())]
-            
-            self.threadWrite = ThreadAsync(self.dev.chip_write, *self.wrdata.pop())
+                image = loadImage(fpath, self.addr)
+
+        except Exception as e:
+            QMessageBox.critical(self, '文件错误', str(e), QMessageBox.Yes)
+            return
+
+        if self.link_open():
+            self.setEnabled(False)
+            self.prgInfo.setVisible(True)
+
+            self.threadWrite = ThreadAsync(self.dev.image_write, image, self.chkIncr.isChecked())
             self.threadWrite.taskFinished.connect(self.on_btnWrite_finished)
             self.threadWrite.start()
 
     def on_btnWrite_finished(self):
-        if len(self.wrdata):
-            self.threadWrite.args = self.wrdata.pop()
-            self.threadWrite.start()
-
-            return
+        self.threadWrite.args = ()  # 释放镜像，.elf 文件的 mmap 映射随之关闭
 
-        QMessageBox.information(self, '烧写完成', '        程序烧写完成        ', QMessageBox.Yes)
+        if self.threadWrite.error:
+            QMessageBox.critical(self, '烧写失败', self.threadWrite.error, QMessageBox.Yes)
+        elif self.threadWrite.result:
+            QMessageBox.information(self, '烧写完成', f'        程序烧写完成，跳过 {len(self.threadWrite.result)} 个未改变的扇区        ', QMessageBox.Yes)
+        else:
+            QMessageBox.information(self, '烧写完成', '        程序烧写完成        ', QMessageBox.Yes)
 
         self.link_close()
 
@@ -266,27 +326,45 @@ class MCUProg(QWidget):
 
     @pyqtSlot()
     def on_btnRead_clicked(self):
-        if self.link_open():
+        binpath, filter = QFileDialog.getSaveFileName(caption='将读取到的数据保存到文件', filter='程序文件 (*.bin)', directory=self.savPath)
+        if not binpath:
+            return
+
+        self.savPath = binpath
+
+        try:
+            self.rdfile = open(binpath, 'wb')   # 边读边写入文件；在连接前打开，打开失败时不必断开连接
+        except Exception as e:
+            QMessageBox.critical(self, '文件错误', str(e), QMessageBox.Yes)
+            return
+
+        if not self.link_open():
+            self.rdfile.close()
+
+        else:
             self.setEnabled(False)
             self.prgInfo.setVisible(True)
 
-            self.rdbuff = []    # bytes 无法 extend，因此用 list
-
-            self.threadRead = ThreadAsync(self.dev.chip_read, self.addr, self.size, self.rdbuff)
+            self.threadRead = ThreadAsync(self.dev.chip_dump, self.addr, self.size, self.rdfile, progress=True)
+            self.threadRead.taskProgress.connect(self.on_prgInfo_progress)
             self.threadRead.taskFinished.connect(self.on_btnRead_finished)
             self.threadRead.start()
 
     def on_btnRead_finished(self):
-        binpath, filter = QFileDialog.getSaveFileName(caption='将读取到的数据保存到文件', filter='程序文件 (*.bin)', directory=self.savPath)
-        if binpath:
-            self.savPath = binpath
-            with open(binpath, 'wb') as f:
-                f.write(bytes(self.rdbuff))
+        self.rdfile.close()
+
+        if self.threadRead.error:
+            QMessageBox.critical(self, '读取失败', self.threadRead.error, QMessageBox.Yes)
 
         self.link_close()
 
         self.setEnabled(True)
         self.prgInfo.setVisible(False)
+        self.prgInfo.setMaximum(0)
+
+    def on_prgInfo_progress(self, done, total):
+        self.prgInfo.setMaximum(total)
+        self.prgInfo.setValue(done)
 
     @property
     def addr(self):
@@ -303,9 +381,9 @@ class MCUProg(QWidget):
         addr = self.cmbAddr.currentText()
 
         self.cmbAddr.clear()
-        for i in range(dev.SECT_SKIP // dev.SECT_SIZE, dev.CHIP_SIZE // dev.SECT_SIZE):
-            if (dev.SECT_SIZE * i) % 1024 == 0:
-                self.cmbAddr.addItem('%d K' %(dev.SECT_SIZE * i     // 1024))
+        for sect_addr, sect_size in dev.sect_map:
+            if sect_addr >= dev.SECT_SKIP and sect_addr % 1024 == 0:
+                self.cmbAddr.addItem('%d K' %(sect_addr // 1024))
 
         self.cmbAddr.setCurrentIndex(zero_if(self.cmbAddr.findText(addr)))
 
@@ -314,6 +392,16 @@ class MCUProg(QWidget):
         else:
             self.btnChipErase.setEnabled(True)
 
+    @pyqtSlot(int)
+    def on_cmbDLL_currentIndexChanged(self, index):
+        ''' Auto 时钟只用于 DAPLink；J-Link、OpenOCD 在打开连接时就设定了时钟，无法逐档测试 '''
+        daplink = isinstance(self.cmbDLL.currentData(), int)
+
+        auto = self.cmbSpeed.findText('Auto')
+        self.cmbSpeed.model().item(auto).setEnabled(daplink)
+        if not daplink and self.cmbSpeed.currentIndex() == auto:
+            self.cmbSpeed.setCurrentIndex(self.cmbSpeed.findText('4 MHz'))
+
     @pyqtSlot(int)
     def on_cmbAddr_currentIndexChanged(self, index):
         if self.cmbAddr.currentText() == '': return
@@ -323,9 +411,9 @@ class MCUProg(QWidget):
         size = self.cmbSize.currentText()
         
         self.cmbSize.clear()
-        for i in range((dev.CHIP_SIZE - self.addr) // dev.SECT_SIZE):
-            if (dev.SECT_SIZE * (i+1)) % 1024 == 0:
-                self.cmbSize.addItem('%d K' %(dev.SECT_SIZE * (i+1) // 1024))
+        for sect_addr, sect_size in dev.sectors(self.addr, dev.CHIP_SIZE - self.addr):
+            if (sect_addr + sect_size - self.addr) % 1024 == 0:
+                self.cmbSize.addItem('%d K' %((sect_addr + sect_size - self.addr) // 1024))
 
         self.cmbSize.setCurrentIndex(zero_if(self.cmbSize.findText(size)))
 
@@ -337,7 +425,7 @@ class MCUProg(QWidget):
 
     @pyqtSlot()
     def on_btnHEX_clicked(self):
-        hexpath, filter = QFileDialog.getOpenFileName(caption='程序文件路径', filter='程序文件 (*.bin *.hex *.ini);;任意文件 (*.*)', directory=self.cmbHEX.currentText())
+        hexpath, filter = QFileDialog.getOpenFileName(caption='程序文件路径', filter='程序文件 (*.bin *.hex *.elf *.axf *.ini);;任意文件 (*.*)', directory=self.cmbHEX.currentText())
         if hexpath:
             self.cmbHEX.insertItem(0, hexpath)
             self.cmbHEX.setCurrentIndex(0)
@@ -367,7 +455,7 @@ class MCUProg(QWidget):
         if column != 2: # 只能设置文件路径
             return
 
-        hexpath, filter = QFileDialog.getOpenFileName(caption='程序文件路径', filter='程序文件 (*.bin *.hex);;任意文件 (*.*)', directory=self.table.item(row, column).text())
+        hexpath, filter = QFileDialog.getOpenFileName(caption='程序文件路径', filter='程序文件 (*.bin *.hex *.elf *.axf);;任意文件 (*.*)', directory=self.table.item(row, column).text())
         if hexpath:
             self.table.setItem(row, column, QtWidgets.QTableWidgetItem(hexpath))
 
@@ -386,53 +474,150 @@ class MCUProg(QWidget):
         self.conf.set('target', 'addr', self.cmbAddr.currentText())
         self.conf.set('target', 'size', self.cmbSize.currentText())
         self.conf.set('target', 'savpath', self.savPath)
+        self.conf.set('target', 'incremental', str(self.chkIncr.isChecked()))
 
         hexpath = [self.cmbHEX.currentText()] + [self.cmbHEX.itemText(i) for i in range(self.cmbHEX.count())]
         self.conf.set('target', 'hexpath', repr(list(collections.OrderedDict.fromkeys(hexpath))))    # 保留顺序去重    
 
         self.conf.write(open('setting.ini', 'w', encoding='utf-8'))
 
+        self.thrDAP.requestInterruption()
+        self.thrDAP.wait()
+
 
 class ThreadAsync(QThread):
     taskFinished = pyqtSignal()
+    taskProgress = pyqtSignal(int, int)     # (done, total)
 
-    def __init__(self, func, *args):
+    def __init__(self, func, *args, progress=False):
+        ''' progress: 为 True 时将 taskProgress.emit 作为最后一个参数传给 func，用于报告进度 '''
         super(ThreadAsync, self).__init__()
         self.func = func
-        self.args = args
+        self.args = args + (self.taskProgress.emit,) if progress else args
+
+        self.result = None
+        self.error  = None
 
     def run(self):
-        self.func(*self.args)
+        self.result = None
+        self.error  = None
+        try:
+            self.result = self.func(*self.args)
+        except Exception as e:
+            self.error = str(e)     # 例如 Flash 算法执行超时，交给 taskFinished 的处理函数显示
         
         self.taskFinished.emit()
 
 
-def parseHex(file):
-    ''' 解析 .hex 文件，提取出程序代码，没有值的地方填充0xFF '''
-    data = ''
-    currentAddr = 0
-    extSegAddr  = 0     # 扩展段地址
-    for line in open(file, 'rb').readlines():
-        line = line.strip()
-        if len(line) == 0: continue
-        
-        len_ = int(line[1:3],16)
-        addr = int(line[3:7],16) + extSegAddr
-        type = int(line[7:9],16)
-        if type == 0x00:
-            if currentAddr != addr:
-                if currentAddr != 0:
-                    data += '\xFF' * (addr - currentAddr)
-                currentAddr = addr
-            for i in range(len_):
-                data += chr(int(line[9+2*i:11+2*i], 16))
-            currentAddr += len_
-        elif type == 0x02:
-            extSegAddr = int(line[9:9+4], 16) * 16
-        elif type == 0x04:
-            extSegAddr = int(line[9:9+4], 16) * 65536
-    
-    return data.encode('latin')
+class ThreadDAP(QThread):
+    ''' 在后台监视调试器的插拔，调试器列表变化时才发出 probesChanged(新的列表)
+        有 libusb1（python 包 usb1）且平台支持时用 libusb 热插拔回调；否则每秒比较一次 USB 设备的 (bus, address, VID, PID)，
+        不读字符串描述符，开销很小，有变化时才完整枚举；两者都不可用时每秒完整枚举一次 '''
+    probesChanged = pyqtSignal(list)
+
+    def __init__(self, unique_ids):
+        super(ThreadDAP, self).__init__()
+
+        self.unique_ids = unique_ids    # 当前调试器列表，用于判断是否变化
+
+        self.lock = threading.Lock()    # 枚举时持有；连接使用中由 GUI 线程持有，阻止枚举
+        self.paused  = False    # 连接使用中，暂不枚举，等恢复后再处理期间的插拔；只在 GUI 线程中读写
+        self.changed = False
+
+    def pause(self):
+        ''' 等待正在进行的枚举结束，之后不再枚举，直到 resume() '''
+        self.lock.acquire()
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.lock.release()
+
+    def retry(self):
+        ''' 丢弃的列表需重新枚举，并且即使没变化也要再发出 '''
+        self.unique_ids = None
+        self.changed = True
+
+    def on_hotplug(self, context, device, event):
+        self.changed = True
+
+        return False    # 不注销回调
+
+    def hotplug(self):
+        try:
+            import usb1
+            context = usb1.USBContext()
+            if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):    # 如 Windows，改用 usbDevices() 轮询
+                context.close()
+                return None, None
+
+            handle = context.hotplugRegisterCallback(self.on_hotplug, flags=0)
+
+            return context, handle
+
+        except Exception as e:
+            return None, None
+
+    def run(self):
+        context, handle = self.hotplug()
+        devices = usbDevices()
+
+        try:
+            while not self.isInterruptionRequested():
+                if context:
+                    context.handleEventsTimeout(1)
+
+                else:
+                    self.msleep(1000)
+
+                    current = usbDevices()
+                    if current is None or current != devices:
+                        devices = current
+                        self.changed = True
+
+                if self.changed and self.lock.acquire(blocking=False):  # 拿不到锁说明连接使用中
+                    try:
+                        self.changed = False
+
+                        probes = daplinks()
+                        unique_ids = [daplink.unique_id for daplink in probes]
+                        if unique_ids != self.unique_ids:
+                            self.unique_ids = unique_ids
+                            self.probesChanged.emit(probes)
+
+                    finally:
+                        self.lock.release()
+
+        finally:
+            if context:
+                context.hotplugDeregisterCallback(handle)
+                context.close()
+
+
+def daplinks():
+    try:
+        from pyocd.probe import aggregator
+        return aggregator.DebugProbeAggregator.get_all_connected_probes()
+    except Exception as e:
+        return []
+
+
+def usbDevices():
+    ''' 当前 USB 设备的 (bus, address, VID, PID) 集合，没有 pyusb 或 libusb 时返回 None '''
+    try:
+        import usb.core
+        return {(dev.bus, dev.address, dev.idVendor, dev.idProduct) for dev in usb.core.find(find_all=True)}
+    except Exception as e:
+        return None
+
+
+def loadImage(file, addr):
+    ''' 读取程序文件，并将其起始地址移到 addr 处 '''
+    image = firmware.load(file)
+    if not image:
+        return image
+
+    return image.relocate(addr - image.start)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,11 @@
+import io
 import math
+import zlib
+import bisect
 import importlib
 
+import firmware
+
 from . import flash
 from . import flashAlgo
 
@@ -8,18 +13,22 @@ from . import flashAlgo
 class Chip(object):
     CHIP_CORE = 'Cortex-M0'
 
+    READ_CHUNK = 1024 * 64  # 直接读取 Flash 时每次读取的字节数
+
     def __init__(self, xlink, falgo):
         super(Chip, self).__init__()
 
         if isinstance(falgo, tuple):
             name, addr, size, path = falgo
 
-            self.falgo = flashAlgo.FlashAlgo(path, addr, size).flash_algo
+            self.falgo = flashAlgo.load(path, addr, size)
             if self.falgo['arch'] == 'RISC-V':  self.CHIP_CORE = 'RISC-V'
 
         else:
             self.falgo = importlib.import_module(f'.{falgo}', 'FlashAlgo').flash_algo
 
+        self.sect_map = SectorMap(self.falgo['sector_sizes'], self.CHIP_SIZE)
+
         if not xlink:   # used for CHIP_SIZE, SECT_SIZE, PAGE_SIZE access
             return
 
@@ -43,12 +52,31 @@ class Chip(object):
     def SECT_SIZE(self):
         starts, sizes = zip(*self.falgo['sector_sizes'])
 
-        return min(sizes)   # 简化处理，大扇区多擦几次也不会出错
+        return min(sizes)   # 最小扇区，擦写时按 sect_map 中的实际扇区操作
 
     @property
     def PAGE_SIZE(self):
         return self.falgo['flash_page_size']
 
+    @property
+    def EMPTY(self):        # Flash 擦除后的值
+        return self.falgo.get('value_empty', 0xFF)
+
+    @property
+    def CRC_SUPPORT(self):  # Flash 可直接寻址时，在目标芯片上计算 CRC32 比较内容，只需传回 4 字节
+        return self.falgo.get('pc_CRC32', 0xFFFFFFFF) < 0xFFFFFFFF and self.falgo['pc_Read'] >= 0xFFFFFFFF
+
+    @property
+    def PAGE_BUFF(self):    # 用于传输烧写数据的 RAM 缓冲区，有两个时可双缓冲烧写
+        return self.falgo.get('page_buffers', [self.falgo['begin_data']])
+
+    @property
+    def BUFF_SIZE(self):    # 缓冲区大小，目标芯片上有 ProgramPages 时一次可烧写多个 page
+        if self.falgo.get('pc_ProgramPages', 0xFFFFFFFF) < 0xFFFFFFFF:
+            return self.falgo['buffer_size']
+        else:
+            return self.PAGE_SIZE
+
     def chip_erase(self):
         self.flash.Init(0, 0, 1)
         self.flash.EraseChip()
@@ -56,23 +84,138 @@ class Chip(object):
 
     def sect_erase(self, addr, size):
         self.flash.Init(0, 0, 1)
-        for i in range(size // self.SECT_SIZE):
-            self.flash.EraseSector(self.CHIP_BASE + addr + self.SECT_SIZE * i)
+        for sect_addr, sect_size in self.sectors(addr, size):
+            self.flash.EraseSector(self.CHIP_BASE + sect_addr)
         self.flash.UnInit(1)
 
-    def chip_write(self, addr, data):
+    def chip_write(self, addr, data, incremental=False):
+        return self.image_write(firmware.Image([(addr, data)]), incremental)
+
+    def image_write(self, image, incremental=False):
+        ''' image: firmware.Image，地址相对于 CHIP_BASE，只擦写有数据的扇区和 page
+            incremental: 增量烧写，内容与 image 相同的扇区不擦除也不烧写
+            返回被跳过的扇区地址列表 '''
+        if image and (image.start < 0 or image.end > self.CHIP_SIZE):
+            raise Exception(f'0x{self.CHIP_BASE + image.start:08X} - 0x{self.CHIP_BASE + image.end:08X} out of flash')
+
+        image = image.align(self.PAGE_SIZE, self.EMPTY)
+
+        skipped = []
+        sects   = []    # 需要擦写的扇区，(addr, size, dirty)
+        regions = []    # 需要烧写的区域，(addr, size)
+        for sect_addr, sect_size, sect_image in image.split(self.sectors):
+            same, dirty = True, False   # dirty：已知扇区中有非空白内容，必须擦除，不必再 BlankCheck
+            if incremental:
+                for addr, data in sect_image:
+                    _same, _blank = self.sect_same(addr, data)
+                    same, dirty = same and _same, dirty or not _blank
+                    if not same and dirty:
+                        break
+
+                if same:
+                    skipped.append(self.CHIP_BASE + sect_addr)
+                    continue
+
+            sects.append((sect_addr, sect_size, dirty))
+
+            if regions and sum(regions[-1]) == sect_addr:
+                regions[-1] = (regions[-1][0], regions[-1][1] + sect_size)
+            else:
+                regions.append((sect_addr, sect_size))
+
+        if skipped:
+            print('Skip unchanged sector @ ' + ', '.join([f'0x{x:08X}' for x in skipped]))
+
+        if not sects:
+            return skipped
+
         self.flash.Init(0, 0, 1)
-        for i in range(math.ceil(len(data) / self.SECT_SIZE)):
-            self.flash.EraseSector(self.CHIP_BASE + addr + self.SECT_SIZE * i)
+        for sect_addr, sect_size, dirty in sects:
+            if not dirty and self.sect_blank(sect_addr, sect_size):     # 整个扇区已是空白，不必擦除
+                print(f'Skip blank sector @ 0x{self.CHIP_BASE + sect_addr:08X}')
+                continue
+
+            self.flash.EraseSector(self.CHIP_BASE + sect_addr)
         self.flash.UnInit(1)
 
         self.flash.Init(0, 0, 2)
-        for i in range(math.ceil(len(data) / self.PAGE_SIZE)):
-            self.flash.ProgramPage(self.CHIP_BASE + addr + self.PAGE_SIZE * i, data[self.PAGE_SIZE*i : self.PAGE_SIZE*(i+1)])
+        for start, size in regions:
+            for addr, data in image.clip(start, size):
+                self.program(addr, data)
         self.flash.UnInit(2)
 
         self.flash.Init(0, 0, 3)
-        if self.falgo['pc_Verify'] >= 0xFFFFFFFF:
+        for start, size in regions:
+            for addr, data in image.clip(start, size):
+                self.verify(addr, data)
+        self.flash.UnInit(3)
+
+        return skipped
+
+    def sectors(self, addr, size):
+        ''' 与 [addr, addr+size) 有交集的扇区，返回 (addr, size) 列表，地址相对于 CHIP_BASE '''
+        return self.sect_map.sectors(addr, size)
+
+    def sect_same(self, addr, data):
+        ''' 扇区当前内容是否与 data 相同、是否为空白，返回 (same, blank) '''
+        blank = bytes([self.EMPTY]) * len(data)
+
+        if self.CRC_SUPPORT:
+            crc = self.flash.CRC32(self.CHIP_BASE + addr, len(data))
+
+            return crc == zlib.crc32(data), crc == zlib.crc32(blank)
+
+        buff = []
+        self.chip_read(addr, len(data), buff)
+
+        return bytes(buff) == data, bytes(buff) == blank
+
+    def sect_blank(self, addr, size):
+        ''' [addr, addr+size) 是否已擦除，只用 FLM 的 BlankCheck；没有时返回 False，照常擦除
+            （在目标芯片上对整个扇区算 CRC32 的开销与擦除相当，不值得） '''
+        if self.falgo['pc_BlankCheck'] < 0xFFFFFFFF:
+            return self.flash.BlankCheck(self.CHIP_BASE + addr, size, self.EMPTY)
+
+        return False
+
+    def program(self, addr, data):
+        ''' 内容全为擦除值的 page 不必烧写；连续的多个 page 合并成一块，一次传入缓冲区并烧写 '''
+        blank = bytes([self.EMPTY]) * self.PAGE_SIZE
+
+        skipped = 0
+        blocks = []     # 需要烧写的区域，(offset in data, size)
+        for i in range(math.ceil(len(data) / self.PAGE_SIZE)):
+            page = data[self.PAGE_SIZE*i : self.PAGE_SIZE*(i+1)]
+
+            if page == blank[:len(page)]:
+                skipped += 1
+
+            elif blocks and sum(blocks[-1]) == self.PAGE_SIZE * i and blocks[-1][1] + len(page) <= self.BUFF_SIZE:
+                blocks[-1] = (blocks[-1][0], blocks[-1][1] + len(page))
+
+            else:
+                blocks.append((self.PAGE_SIZE * i, len(page)))
+
+        if skipped:
+            print(f'Skip {skipped} blank pages')
+
+        blocks = [(self.CHIP_BASE + addr + start, data[start : start+size]) for start, size in blocks]
+
+        if len(self.PAGE_BUFF) > 1 and self.xlink.background_access:
+            self.program_pipelined(blocks)
+
+        else:
+            for block_addr, block in blocks:
+                self.xlink.write_mem_U8(self.PAGE_BUFF[0], block)
+
+                self.flash.ProgramPageStart(block_addr, len(block), self.PAGE_BUFF[0])
+                self.flash.ProgramPageFinish(block_addr, len(block))
+
+    def verify(self, addr, data):
+        if self.CRC_SUPPORT and self.flash.CRC32(self.CHIP_BASE + addr, len(data)) == zlib.crc32(data):
+            print('Verify OK')
+
+        elif self.falgo['pc_Verify'] >= 0xFFFFFFFF:     # CRC 不一致时也读回比较，找出出错的位置
             c_char_Array = self.xlink.read_mem_U8(self.CHIP_BASE + addr, len(data))
 
             buff = list(bytes(c_char_Array))
@@ -87,18 +230,113 @@ class Chip(object):
         else:
             for i in range(math.ceil(len(data) / self.PAGE_SIZE)):
                 self.flash.Verify(self.CHIP_BASE + addr + self.PAGE_SIZE * i, data[self.PAGE_SIZE*i : self.PAGE_SIZE*(i+1)])
-        self.flash.UnInit(3)
+
+    def program_pipelined(self, blocks):
+        ''' 双缓冲烧写：第 N 块烧写的同时，将第 N+1 块数据传入另一个缓冲区 '''
+        pending = None  # 正在烧写的块，(addr, size)
+
+        for i, (block_addr, block) in enumerate(blocks):
+            buff = self.PAGE_BUFF[i % 2]
+
+            self.xlink.write_mem_U8(buff, block)
+
+            if pending is not None:
+                self.flash.ProgramPageFinish(*pending)
+
+            pending = (block_addr, len(block))
+            self.flash.ProgramPageStart(block_addr, len(block), buff)
+
+        if pending is not None:
+            self.flash.ProgramPageFinish(*pending)
 
     def chip_read(self, addr, size, buff):
+        sink = io.BytesIO()
+        self.chip_dump(addr, size, sink)
+
+        buff.extend(sink.getbuffer())
+
+    def chip_dump(self, addr, size, sink, progress=None):
+        ''' 分块读取 [addr, addr+size)，每块读到同一个 bytearray 中，再写入 sink（例如打开的文件）
+            progress: progress(done, size) 报告进度 '''
         if self.falgo['pc_Read'] >= 0xFFFFFFFF:
-            c_char_Array = self.xlink.read_mem_U8(self.CHIP_BASE + addr, size)
+            chunk = self.READ_CHUNK
 
-            buff.extend(list(bytes(c_char_Array)))
+        elif len(self.PAGE_BUFF) > 1 and self.xlink.background_access:
+            return self.dump_pipelined(addr, size, sink, progress)
 
         else:
-            for i in range(0, size // self.PAGE_SIZE):
-                self.flash.Read(self.CHIP_BASE + addr + self.PAGE_SIZE * i, self.PAGE_SIZE)
+            chunk = self.PAGE_SIZE      # Flash 不可直接寻址，由算法的 Read() 逐 page 读到 RAM 中
+
+        buff = memoryview(bytearray(chunk))
+
+        for start in range(0, size, chunk):
+            n = min(chunk, size - start)
+
+            if self.falgo['pc_Read'] >= 0xFFFFFFFF:
+                self.xlink.read_mem_into(self.CHIP_BASE + addr + start, buff[:n])
+
+            else:
+                self.flash.Read(self.CHIP_BASE + addr + start, n)
+
+                self.xlink.read_mem_into(self.falgo['begin_data'], buff[:n])
+
+            sink.write(buff[:n])
+
+            if progress:
+                progress(start + n, size)
+
+    def dump_pipelined(self, addr, size, sink, progress=None):
+        ''' 双缓冲读取：算法的 Read() 将第 N+1 块读到一个缓冲区的同时，从另一个缓冲区传回第 N 块 '''
+        chunk = self.falgo['buffer_size']
+
+        buff = memoryview(bytearray(chunk))
+
+        blocks = [(start, min(chunk, size - start)) for start in range(0, size, chunk)]
+        if not blocks:
+            return
+
+        self.flash.ReadStart(self.CHIP_BASE + addr, blocks[0][1], self.PAGE_BUFF[0])
+
+        for i, (start, n) in enumerate(blocks):
+            self.flash.ReadFinish(self.CHIP_BASE + addr + start, n)
+
+            if i + 1 < len(blocks):
+                next_start, next_n = blocks[i+1]
+                self.flash.ReadStart(self.CHIP_BASE + addr + next_start, next_n, self.PAGE_BUFF[(i+1) % 2])
+
+            self.xlink.read_mem_into(self.PAGE_BUFF[i % 2], buff[:n])
+
+            sink.write(buff[:n])
+
+            if progress:
+                progress(start + n, size)
+
+
+class SectorMap(object):
+    ''' Flash 扇区布局，由 FlashDevice.sectors 中的 (AddrSector, szSector) 表生成
+        表中每项表示从 AddrSector 开始、直到下一项（或 Flash 末尾）为止，都是大小为 szSector 的扇区 '''
+
+    def __init__(self, sector_sizes, flash_size):
+        self.starts = [start for start, size in sector_sizes]
+        self.sizes  = [size  for start, size in sector_sizes]
+        self.ends   = self.starts[1:] + [flash_size]
+
+    def sectors(self, addr, size):
+        ''' 与 [addr, addr+size) 有交集的扇区，返回 (addr, size) 列表 '''
+        sects = []
+
+        i = max(bisect.bisect_right(self.starts, addr) - 1, 0)
+        while i < len(self.starts) and self.starts[i] < addr + size:
+            start, sect_size, end = self.starts[i], self.sizes[i], self.ends[i]
+
+            sect_addr = start + max(addr - start, 0) // sect_size * sect_size
+            while sect_addr < min(end, addr + size):
+                sects.append((sect_addr, sect_size))
+                sect_addr += sect_size
+
+            i += 1
 
-                c_char_Array = self.xlink.read_mem_U8(self.falgo['begin_data'], self.PAGE_SIZE)
+        return sects
 
-                buff.extend(list(bytes(c_char_Array)))
+    def __iter__(self):
+        return iter(self.sectors(0, self.ends[-1]))
@@ -4,32 +4,78 @@
 """
 import os
 import sys
+import math
 import time
+import zlib
 import struct
 
 
 class Flash(object):
+    TIMEOUT  = 1.0      # 函数执行的最短超时时间（秒）
+    POLL_MAX = 0.02     # 查询函数是否执行完成的最长间隔（秒）
+
+    ERASE_CHIP_SCALE = 4    # 整片擦除的超时是扇区擦除超时的倍数
+
     def __init__(self, xlink, falgo):
         self.xlink = xlink
 
         self.falgo = falgo
 
+        self.names = {pc: name[3:] for name, pc in self.falgo.items() if name.startswith('pc_')}
+
+        self.elapsed = {}   # (pc, size): 以往的执行时间
+
         # perform a reset and stop the core on the reset handler
         self.xlink.reset_and_halt()
         
         if self.xlink.mode.startswith('arm'):
-            self.xlink.write_reg('r9', self.falgo['static_base'])
-            self.xlink.write_reg('sp', self.falgo['begin_stack'])
+            self.xlink.write_regs({'r9': self.falgo['static_base'], 'sp': self.falgo['begin_stack']})
 
         elif self.xlink.mode.startswith('rv'):
-            self.xlink.write_reg('gp', self.falgo['static_base'])
-            self.xlink.write_reg('sp', self.falgo['begin_stack'])
+            self.xlink.write_regs({'gp': self.falgo['static_base'], 'sp': self.falgo['begin_stack']})
 
             dcsr = self.xlink.read_reg('dcsr')
             self.xlink.write_reg('dcsr', dcsr | (1 << 15))  # when ebreak execute, enter debug mode
 
         # 将Flash算法下载到RAM
-        self.xlink.write_mem_U32(self.falgo['load_address'], self.falgo['instructions'])
+        self.download()
+
+    def download(self):
+        ''' 算法已在 RAM 中时（例如上次操作后 RAM 未掉电），只需重新初始化它的 RW、ZI 段 '''
+        load = self.falgo['load_address']
+
+        if self.resident():
+            print('Flash algorithm already in RAM')
+
+            start = (self.falgo['static_base'] - load) // 4
+            end   = ((self.falgo['pc_CRC32'] & ~1) - load) // 4
+
+            self.xlink.write_mem_U32(load + start * 4, self.falgo['instructions'][start:end])
+
+        else:
+            self.xlink.write_mem_U32(load, self.falgo['instructions'])
+
+    def resident(self):
+        ''' 先读回断点 header 和 CRC32 程序，确认可以执行后，再用 CRC32 检查 RAM 中算法的代码部分是否完整 '''
+        if 'pc_CRC32' not in self.falgo:
+            return False
+
+        load = self.falgo['load_address']
+        code = self.falgo['static_base'] - load             # header + RO 段
+        tail = (self.falgo['pc_CRC32'] & ~1) - load         # CRC32 和 ProgramPages 程序
+        crcs = (self.falgo['pc_ProgramPages'] & ~1) - load
+
+        words = self.falgo['instructions']
+        if list(self.xlink.read_mem_U32(load, 8)) != words[:8]:
+            return False
+
+        if list(self.xlink.read_mem_U32(load + tail, (crcs - tail) // 4)) != words[tail//4 : crcs//4]:
+            return False
+
+        blob = struct.pack(f'<{len(words)}L', *words)
+
+        return self.CRC32(load, code) == zlib.crc32(blob[:code]) and \
+               self.CRC32(load + tail, len(blob) - tail) == zlib.crc32(blob[tail:])
 
     def Init(self, addr, clk, func):    # func: 1 - Erase, 2 - Program, 3 - Verify
         print(f'Init {func}')
@@ -48,25 +94,40 @@ class Flash(object):
     def EraseSector(self, addr):
         print(f'Erase @ 0x{addr:08X}')
 
-        res = self.callFunctionAndWait(self.falgo['pc_EraseSector'], addr)
+        res = self.callFunctionAndWait(self.falgo['pc_EraseSector'], addr, size=self.sector_size(addr))
 
         if res != 0: print(f'EraseSector({addr:08X}) error: {res}')
 
     def ProgramPage(self, addr, data):
+        self.xlink.write_mem_U8(self.falgo['begin_data'], data) # 将要烧写的数据传入单片机RAM
+
+        self.ProgramPageStart(addr, len(data), self.falgo['begin_data'])
+        self.ProgramPageFinish(addr, len(data))
+
+    def ProgramPageStart(self, addr, size, buff):
+        ''' 启动烧写 buff 中已有的数据后立即返回，调用 ProgramPageFinish 等待烧写完成
+            size 大于 page 时由 ProgramPages 在目标芯片上逐页调用 ProgramPage '''
         print(f'Write @ 0x{addr:08X}')
 
-        self.xlink.write_mem_U8(self.falgo['begin_data'], data) # 将要烧写的数据传入单片机RAM
+        if size > self.falgo['flash_page_size']:
+            self.callFunction(self.falgo['pc_ProgramPages'], addr, size, buff, self.falgo['flash_page_size'], size=size)
+        else:
+            self.callFunction(self.falgo['pc_ProgramPage'], addr, size, buff, size=size)
 
-        res = self.callFunctionAndWait(self.falgo['pc_ProgramPage'], addr, len(data), self.falgo['begin_data'])
+    def ProgramPageFinish(self, addr, size):
+        res = self.waitFunction()
 
-        if res != 0: print(f'ProgramPage({addr:08X}) error: {res}')
+        if size > self.falgo['flash_page_size']:
+            if res != addr+size: print(f'ProgramPage({res:08X}) error')
+        else:
+            if res != 0: print(f'ProgramPage({addr:08X}) error: {res}')
 
     def Verify(self, addr, data):
         print(f'Verify @ 0x{addr:08X}')
 
         self.xlink.write_mem_U8(self.falgo['begin_data'], data) # 将要校验的数据传入单片机RAM
 
-        res = self.callFunctionAndWait(self.falgo['pc_Verify'], addr, len(data), self.falgo['begin_data'])
+        res = self.callFunctionAndWait(self.falgo['pc_Verify'], addr, len(data), self.falgo['begin_data'], size=len(data))
 
         if res != addr+len(data): print(f'Verify({addr:08X}) error: {res}')
 
@@ -76,45 +137,121 @@ class Flash(object):
         if res != 0: print(f'EraseChip() error: {res}')
 
     def BlankCheck(self, addr, size, value):
-        res = self.callFunctionAndWait(self.falgo['pc_BlankCheck'], addr, size, value)
+        print(f'BlankCheck @ 0x{addr:08X}')
+
+        res = self.callFunctionAndWait(self.falgo['pc_BlankCheck'], addr, size, value, size=size)
+
+        return res == 0     # 0: 空白，1: 非空白
 
-        if res != 0: print(f'BlankCheck({addr:08X}) error: {res}')
+    def CRC32(self, addr, size, crc=0):
+        ''' 在目标芯片上计算 [addr, addr+size) 的 CRC32，结果与 zlib.crc32(data, crc) 相同 '''
+        print(f'CRC32 @ 0x{addr:08X}')
+
+        return self.callFunctionAndWait(self.falgo['pc_CRC32'], addr, size, crc, size=size)
 
     def Read(self, addr, size):
         print(f'Read @ 0x{addr:08X}')
 
-        res = self.callFunctionAndWait(self.falgo['pc_Read'], addr, size, self.falgo['begin_data'])
+        res = self.callFunctionAndWait(self.falgo['pc_Read'], addr, size, self.falgo['begin_data'], size=size)
+
+        if res != addr+size: print(f'Read({addr:08X}) error: {res}')
+
+    def ReadStart(self, addr, size, buff):
+        ''' 启动读取到 buff 后立即返回，调用 ReadFinish 等待读取完成 '''
+        print(f'Read @ 0x{addr:08X}')
+
+        self.callFunction(self.falgo['pc_Read'], addr, size, buff, size=size)
+
+    def ReadFinish(self, addr, size):
+        res = self.waitFunction()
 
         if res != addr+size: print(f'Read({addr:08X}) error: {res}')
 
-    def callFunction(self, pc, r0=None, r1=None, r2=None, r3=None):
+    def sector_size(self, addr):
+        ''' addr 所在扇区的大小 '''
+        offset = addr - self.falgo['flash_start']
+
+        return [size for start, size in self.falgo['sector_sizes'] if start <= offset][-1]
+
+    def timeout(self, pc, size):
+        ''' 函数执行的超时时间（秒），由 FlashDevice 中的 toProg、toErase 算出 '''
+        size = size or 0
+
+        if pc == self.falgo['pc_EraseSector']:
+            timeout = self.falgo.get('erase_timeout', 3000) / 1000
+
+        elif pc == self.falgo['pc_EraseChip']:  # toErase 是擦除一个扇区的超时，整片擦除按它的几倍计，不按扇区数累加，以免超时长达数小时
+            timeout = self.falgo.get('erase_timeout', 3000) / 1000 * self.ERASE_CHIP_SCALE
+
+        elif pc == self.falgo['pc_ProgramPage']:
+            timeout = self.falgo.get('prog_timeout', 1000) / 1000
+
+        elif pc == self.falgo.get('pc_ProgramPages'):
+            timeout = self.falgo.get('prog_timeout', 1000) / 1000 * math.ceil(size / self.falgo['flash_page_size'])
+
+        else:   # Init、UnInit、Verify、BlankCheck、Read、CRC32 等，按最慢 50KB/s 估算
+            timeout = size / 50000
+
+        return max(timeout, self.TIMEOUT)
+
+    def callFunction(self, pc, r0=None, r1=None, r2=None, r3=None, size=None):
+        ''' size: 函数处理的数据量，用于计算超时和区分以往的执行时间 '''
+        regs = {}   # 一次写入所有寄存器
         if self.xlink.mode.startswith('arm'):
-            if r0 is not None: self.xlink.write_reg('r0', r0)
-            if r1 is not None: self.xlink.write_reg('r1', r1)
-            if r2 is not None: self.xlink.write_reg('r2', r2)
-            if r3 is not None: self.xlink.write_reg('r3', r3)
+            if r0 is not None: regs['r0'] = r0
+            if r1 is not None: regs['r1'] = r1
+            if r2 is not None: regs['r2'] = r2
+            if r3 is not None: regs['r3'] = r3
 
-            self.xlink.write_reg('pc', pc)
-            self.xlink.write_reg('lr', self.falgo['load_address'] + 1)
+            regs['pc'] = pc
+            regs['lr'] = self.falgo['load_address'] + 1
 
         elif self.xlink.mode.startswith('rv'):
-            if r0 is not None: self.xlink.write_reg('a0', r0)
-            if r1 is not None: self.xlink.write_reg('a1', r1)
-            if r2 is not None: self.xlink.write_reg('a2', r2)
-            if r3 is not None: self.xlink.write_reg('a3', r3)
-
-            self.xlink.write_reg('pc', pc)      # OpenOCD: resume from current code position.
-            self.xlink.write_reg('dpc', pc)     # When resuming, PC is updated to value in dpc.
-            self.xlink.write_reg('ra', self.falgo['load_address'])
-        
-        self.xlink.go()
+            if r0 is not None: regs['a0'] = r0
+            if r1 is not None: regs['a1'] = r1
+            if r2 is not None: regs['a2'] = r2
+            if r3 is not None: regs['a3'] = r3
+
+            regs['pc']  = pc    # OpenOCD: resume from current code position.
+            regs['dpc'] = pc    # When resuming, PC is updated to value in dpc.
+            regs['ra']  = self.falgo['load_address']
+
+        with self.xlink.session():   # DAPLink：写寄存器、go() 与之前写入的数据一起发送
+            self.xlink.write_regs(regs)
+
+            self.xlink.go()
+
+        self.running = (pc, size, time.time())
+
+    def callFunctionAndWait(self, pc, r0=None, r1=None, r2=None, r3=None, size=None):
+        self.callFunction(pc, r0, r1, r2, r3, size)
+
+        return self.waitFunction()
+
+    def waitFunction(self):
+        ''' 等待函数执行完成（运行到断点处 halt）：先按以往的执行时间休眠，然后以逐渐增长的间隔查询 '''
+        pc, size, start = self.running
+
+        timeout = self.timeout(pc, size)
+
+        if (pc, size) in self.elapsed:
+            time.sleep(max(start + self.elapsed[(pc, size)] * 0.8 - time.time(), 0))
 
-    def callFunctionAndWait(self, pc, r0=None, r1=None, r2=None, r3=None):
-        self.callFunction(pc, r0, r1, r2, r3)
-        
         # Wait until the breakpoint is hit
+        interval = 0.001
         while not self.xlink.halted():
-            time.sleep(0.001)
+            if time.time() - start > timeout:
+                self.xlink.halt()
+                raise Exception(f'{self.names.get(pc, hex(pc))}() not finished in {timeout:.1f}s, timeout')
+
+            time.sleep(interval)
+            interval = min(interval * 2, self.POLL_MAX)
+
+        elapsed = time.time() - start
+        if (pc, size) in self.elapsed:
+            self.elapsed[(pc, size)] = self.elapsed[(pc, size)] * 0.7 + elapsed * 0.3
+        else:
+            self.elapsed[(pc, size)] = elapsed
 
         if self.xlink.mode.startswith('arm'):
             return self.xlink.read_reg('r0')
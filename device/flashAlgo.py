@@ -1,4 +1,6 @@
 #! python3
+import os
+import json
 import ctypes
 import struct
 import collections
@@ -37,6 +39,24 @@ class FlashAlgo(object):
     ALGO_HEADER_RV =  [0x00100073, 0x00000013, 0x00000013, 0x00000013, 0x00000013, 0x00000013, 0x00000013, 0x00000013]
     SIZE_HEADER = len(ALGO_HEADER_ARM) * 4
 
+    ''' 计算 CRC32（结果与 zlib.crc32 相同），r0/a0: addr, r1/a1: size, r2/a2: crc 初值；位置无关，加载在算法 ZI 段之后 '''
+    CRC32_ARM = [0x4B0843D2, 0xD00A2900, 0x30017804, 0x24084062, 0xD3000852, 0x3C01405A, 0x3901D1FA, 0x43D0D1F4,
+                 0x46C04770, 0xEDB88320]
+    CRC32_RV  = [0xFFF64613, 0xEDB886B7, 0x32068693, 0x02058A63, 0x00054283, 0x00150513, 0x00564633, 0x00800313,
+                 0x00167393, 0x00165613, 0x00038463, 0x00D64633, 0xFFF30313, 0xFE0316E3, 0xFFF58593, 0xFC059AE3,
+                 0xFFF64513, 0x00008067]
+
+    ''' 在目标芯片上逐页调用 ProgramPage 烧写 buff 中的多个 page，r0/a0: addr, r1/a1: size, r2/a2: buff, r3/a3: page size
+        全部成功返回 addr + size，否则返回出错 page 的地址；加载在 CRC32 程序之后，末尾再加上 ProgramPage 的地址 '''
+    PROG_PAGES_ARM = [0x4604B5F0, 0x46161845, 0x42AC461F, 0x4620D20C, 0x42B91B29, 0x4639D900, 0x4B054632, 0x28004798,
+                      0x19E4D103, 0xE7F019F6, 0x4620462C, 0x46C0BDF0]
+    PROG_PAGES_RV  = [0xFE010113, 0x00112E23, 0x00812C23, 0x00912A23, 0x01212823, 0x01312623, 0x00050413, 0x00B504B3,
+                      0x00060913, 0x00068993, 0x02947A63, 0x00040513, 0x408485B3, 0x00B9F463, 0x00098593, 0x00090613,
+                      0x00000297, 0x0402A283, 0x000280E7, 0x00051A63, 0x01340433, 0x01390933, 0xFD1FF06F, 0x00048413,
+                      0x00040513, 0x01C12083, 0x01812403, 0x01412483, 0x01012903, 0x00C12983, 0x02010113, 0x00008067]
+
+    SIZE_STACK = 1024   # 为算法保留的栈空间，与 flash_algo.py 生成的算法一致
+
     def __init__(self, path, ram_start, ram_size: 'size of RAM for Algorithm'):
         self.flash_algo = {}
 
@@ -60,18 +80,30 @@ class FlashAlgo(object):
 
             self.parseAlgo()
 
+            if self.flash_algo['arch'] == 'ARM':
+                header, crc32, pages, thumb = self.ALGO_HEADER_ARM, self.CRC32_ARM, self.PROG_PAGES_ARM, 1
+
+            elif self.flash_algo['arch'] == 'RISC-V':
+                header, crc32, pages, thumb = self.ALGO_HEADER_RV,  self.CRC32_RV,  self.PROG_PAGES_RV,  0
+
+            pages = pages + [self.flash_algo['pc_ProgramPage']]
+
+            addr_crc32 = ram_start + self.SIZE_HEADER + len(self.algo_data)
+            addr_pages = addr_crc32 + len(crc32) * 4
+
+            self.flash_algo['pc_CRC32']        = addr_crc32 + thumb
+            self.flash_algo['pc_ProgramPages'] = addr_pages + thumb
+
             self.flash_algo['load_address'] = ram_start
             self.flash_algo['static_base']  = ram_start + self.SIZE_HEADER + self.ro_size
-            self.flash_algo['begin_data']   = ram_start + self.SIZE_HEADER + self.ro_size + self.rw_size + self.zi_size
+            self.flash_algo['begin_data']   = addr_pages + len(pages) * 4
             self.flash_algo['begin_stack']  = ram_start + ram_size
 
-            algo_word = struct.unpack('<' + 'L' * (len(self.algo_data) // 4), self.algo_data)
+            self.flash_algo['page_buffers'], self.flash_algo['buffer_size'] = self.pageBuffers(ram_start + ram_size)
 
-            if self.flash_algo['arch'] == 'ARM':
-                self.flash_algo['instructions'] = self.ALGO_HEADER_ARM + [word for word in algo_word]
+            algo_word = struct.unpack('<' + 'L' * (len(self.algo_data) // 4), self.algo_data)
 
-            elif self.flash_algo['arch'] == 'RISC-V':
-                self.flash_algo['instructions'] = self.ALGO_HEADER_RV  + [word for word in algo_word]
+            self.flash_algo['instructions'] = header + [word for word in algo_word] + crc32 + pages
 
         except Exception as e:
             print(f'parse elf file fail: {e}')
@@ -85,6 +117,9 @@ class FlashAlgo(object):
         self.flash_algo['flash_start']      = fldev.DevAdr
         self.flash_algo['flash_size']       = fldev.szDev
         self.flash_algo['flash_page_size']  = fldev.szPage
+        self.flash_algo['value_empty']      = fldev.valEmpty
+        self.flash_algo['prog_timeout']     = fldev.toProg      # ms
+        self.flash_algo['erase_timeout']    = fldev.toErase     # ms
 
         self.flash_algo['sector_sizes'] = []
         for sector in fldev.sectors:
@@ -93,6 +128,19 @@ class FlashAlgo(object):
             
             self.flash_algo['sector_sizes'].append((sector.AddrSector, sector.szSector))
 
+    def pageBuffers(self, ram_end):
+        ''' 空闲 RAM 若能容纳两个 page，则平分为两个缓冲区（每个可容纳多个 page）用作双缓冲：
+            烧写一个缓冲区中数据的同时传输下一批数据到另一个缓冲区；返回 (缓冲区地址列表, 缓冲区大小) '''
+        begin_data = self.flash_algo['begin_data']
+        page_size  = self.flash_algo['flash_page_size']
+
+        buff_size = (ram_end - self.SIZE_STACK - begin_data) // 2 // page_size * page_size
+
+        if buff_size >= page_size:
+            return [begin_data, begin_data + buff_size], buff_size
+        else:
+            return [begin_data], page_size
+
     def parseAlgo(self):
         for section in self.elf.iter_sections():
             name_and_type = (section.name, section['sh_type'])
@@ -118,6 +166,7 @@ class FlashAlgo(object):
         self.zi_size  = s_zi['sh_size']
 
         self.algo_data = bytearray(self.ro_size + self.rw_size + self.zi_size)
+        self.algo_data += bytes(-len(self.algo_data) % 4)   # 补齐到 4 字节，其后的 CRC32 程序需要对齐
         for section in (s_ro, s_rw):
             start, size = section['sh_addr'], section['sh_size']
             
@@ -136,6 +185,50 @@ class FlashAlgo(object):
                 continue
 
 
+''' 解析 FLM 较慢，将解析结果缓存在 FLM 所在目录的 __flmcache__ 中；FlashAlgo 生成的 flash_algo 格式改变时需修改 CACHE_VERSION '''
+CACHE_VERSION = 1
+
+_cache = {}     # 进程内缓存
+
+def load(path, ram_start, ram_size):
+    stat = os.stat(path)
+    key = [CACHE_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size, ram_start, ram_size]
+
+    if tuple(key) in _cache:
+        return _cache[tuple(key)]
+
+    dirname, filename = os.path.split(os.path.abspath(path))
+    cachepath = os.path.join(dirname, '__flmcache__', f'{filename}.{ram_start:08X}.{ram_size:X}.json')
+
+    try:
+        with open(cachepath, 'r') as f:
+            cache = json.load(f)
+
+        if cache['key'] == key:
+            falgo = cache['flash_algo']
+        else:
+            falgo = None
+
+    except Exception as e:
+        falgo = None
+
+    if falgo is None:
+        falgo = FlashAlgo(path, ram_start, ram_size).flash_algo
+
+        if 'instructions' not in falgo:     # 解析失败，不缓存
+            return falgo
+
+        try:
+            os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+            with open(cachepath, 'w') as f:
+                json.dump({'key': key, 'flash_algo': falgo}, f)
+        except Exception as e:
+            print(f'write flm cache fail: {e}')
+
+    _cache[tuple(key)] = falgo
+
+    return falgo
+
 
 if __name__ == '__main__':
     falgo = FlashAlgo('../FlashAlgo/STM32F10x_128.FLM', 0x20000000, 0x1000)
@@ -0,0 +1,220 @@
+#! python3
+import mmap
+import bisect
+
+
+class HexFile(object):
+    ''' Intel HEX 文件，迭代时逐行解析，依次返回连续的数据段 (addr, memoryview)
+        起始地址记录（03、05）解析后保存在 start 中 '''
+
+    def __init__(self, path):
+        self.path  = path
+        self.start = None
+
+    def __iter__(self):
+        base = 0            # 扩展段地址（02）或扩展线性地址（04）
+        addr = None         # 当前数据段的起始地址
+        data = bytearray()  # 当前数据段
+
+        with open(self.path, 'r') as f:
+            for i, line in enumerate(f, 1):
+                line = line.strip()
+                if not line: continue
+
+                try:
+                    if line[0] != ':': raise ValueError
+                    rec = bytes.fromhex(line[1:])
+                except ValueError:
+                    raise Exception(f'{self.path}:{i}: invalid record')
+
+                if len(rec) < 5 or len(rec) != rec[0] + 5:
+                    raise Exception(f'{self.path}:{i}: invalid record length')
+
+                if sum(rec) & 0xFF:
+                    raise Exception(f'{self.path}:{i}: checksum error')
+
+                type = rec[3]
+                if type == 0x00:
+                    offset = base + (rec[1] << 8 | rec[2])
+                    if addr is not None and offset != addr + len(data):
+                        yield addr, memoryview(data)
+
+                        addr, data = None, bytearray()
+
+                    if addr is None:
+                        addr = offset
+
+                    data += rec[4:-1]
+
+                elif type == 0x01:
+                    break
+
+                elif type == 0x02:
+                    base = (rec[4] << 8 | rec[5]) << 4
+
+                elif type == 0x03:
+                    self.start = (rec[4] << 8 | rec[5]) << 4 | (rec[6] << 8 | rec[7])
+
+                elif type == 0x04:
+                    base = (rec[4] << 8 | rec[5]) << 16
+
+                elif type == 0x05:
+                    self.start = int.from_bytes(rec[4:8], 'big')
+
+                else:
+                    raise Exception(f'{self.path}:{i}: unknown record type {type:02X}')
+
+        if data:
+            yield addr, memoryview(data)
+
+
+class Image(object):
+    ''' 稀疏的程序镜像：按地址排序、互不重叠的数据段 (addr, data)，数据段之间的空隙不擦除也不烧写 '''
+
+    def __init__(self, segments=()):
+        self.segments = []
+
+        for addr, data in segments:
+            self.add(addr, data)
+
+    def add(self, addr, data, overlay=False):
+        ''' overlay 为 False 时与已有数据段重叠会抛出异常，为 True 时用 data 覆盖重叠部分 '''
+        data = memoryview(data).cast('B')
+        if not data:
+            return
+
+        end = addr + len(data)
+        if not self.segments or addr >= self.end:     # 按地址顺序添加时无需查找
+            self.segments.append((addr, data))
+            return
+
+        i = bisect.bisect_right([seg_addr + len(seg_data) for seg_addr, seg_data in self.segments], addr)
+        j = i
+        while j < len(self.segments) and self.segments[j][0] < end:
+            j += 1
+
+        if i < j and not overlay:
+            seg_addr, seg_data = self.segments[i]
+            raise Exception(f'0x{addr:08X} - 0x{end:08X} overlaps 0x{seg_addr:08X} - 0x{seg_addr + len(seg_data):08X}')
+
+        pieces = [(addr, data)]
+        if i < j:
+            head_addr, head = self.segments[i]
+            if head_addr < addr:
+                pieces.insert(0, (head_addr, head[:addr - head_addr]))
+
+            tail_addr, tail = self.segments[j-1]
+            if tail_addr + len(tail) > end:
+                pieces.append((end, tail[end - tail_addr:]))
+
+        self.segments[i:j] = pieces
+
+    def merge(self, image, overlay=False):
+        for addr, data in image:
+            self.add(addr, data, overlay)
+
+        return self
+
+    def relocate(self, offset):
+        return Image((addr + offset, data) for addr, data in self.segments)
+
+    def clip(self, addr, size):
+        ''' [addr, addr+size) 范围内的部分，数据不复制 '''
+        image = Image()
+        for seg_addr, data in self.segments:
+            lo = max(seg_addr, addr)
+            hi = min(seg_addr + len(data), addr + size)
+            if lo < hi:
+                image.segments.append((lo, data[lo - seg_addr : hi - seg_addr]))
+
+        return image
+
+    def split(self, sectors):
+        ''' 按扇区切分，sectors(addr, size) 返回与 [addr, addr+size) 有交集的扇区 (addr, size) 列表
+            返回 (sect_addr, sect_size, Image) 列表，只包含有数据的扇区 '''
+        sects = {}
+        for addr, data in self.segments:
+            for sect_addr, sect_size in sectors(addr, len(data)):
+                sects[(sect_addr, sect_size)] = None
+
+        return [(sect_addr, sect_size, self.clip(sect_addr, sect_size)) for sect_addr, sect_size in sects]
+
+    def align(self, size, fill=0xFF):
+        ''' 将数据段扩展到 size 对齐，落在同一个 size 块中的数据段合并，空隙填充 fill；已对齐的数据段不复制 '''
+        blocks = []     # (addr, end, [segments])
+        for addr, data in self.segments:
+            lo = addr // size * size
+            hi = -(-(addr + len(data)) // size) * size
+            if blocks and lo < blocks[-1][1]:
+                blocks[-1] = (blocks[-1][0], hi, blocks[-1][2] + [(addr, data)])
+            else:
+                blocks.append((lo, hi, [(addr, data)]))
+
+        image = Image()
+        for lo, hi, segs in blocks:
+            if len(segs) == 1 and segs[0][0] == lo and len(segs[0][1]) == hi - lo:
+                image.segments.append(segs[0])
+                continue
+
+            buff = bytearray([fill]) * (hi - lo)
+            for addr, data in segs:
+                buff[addr - lo : addr - lo + len(data)] = data
+
+            image.segments.append((lo, memoryview(buff)))
+
+        return image
+
+    @property
+    def start(self):
+        return self.segments[0][0]
+
+    @property
+    def end(self):
+        return self.segments[-1][0] + len(self.segments[-1][1])
+
+    @property
+    def size(self):     # 数据的总字节数，不含空隙
+        return sum(len(data) for addr, data in self.segments)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+
+def elfSegments(path):
+    ''' .elf/.axf 文件中的 PT_LOAD 段，返回 (p_paddr, data) 列表，data 直接引用 mmap 映射的文件，不复制 '''
+    from elftools.elf.elffile import ELFFile
+
+    with open(path, 'rb') as f:
+        segments = [(seg['p_paddr'], seg['p_offset'], seg['p_filesz']) for seg in ELFFile(f).iter_segments()
+                                                                        if seg['p_type'] == 'PT_LOAD' and seg['p_filesz']]
+
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    return [(addr, view[offset : offset + size]) for addr, offset, size in segments]
+
+
+def load(path, addr=0):
+    ''' 读取程序文件，.hex、.elf 文件中的数据放在文件指定的地址，其他文件作为二进制数据放在 addr 处 '''
+    if path.lower().endswith('.hex'):
+        return Image(HexFile(path))
+
+    if path.lower().endswith(('.elf', '.axf')):
+        return Image(elfSegments(path))
+
+    with open(path, 'rb') as f:
+        return Image([(addr, f.read())])
+
+
+
+if __name__ == '__main__':
+    import sys
+
+    hex = HexFile(sys.argv[1])
+    for addr, data in hex:
+        print(f'0x{addr:08X} - 0x{addr + len(data):08X}: {len(data)} bytes')
+
+    if hex.start is not None:
+        print(f'start: 0x{hex.start:08X}')
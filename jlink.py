@@ -55,14 +55,20 @@ class JLink(object):
         self.jlk.JLINKARM_WriteU64(addr, val)
 
     def write_mem_U8(self, addr, data):
-        buffer = (ctypes.c_uint8 * len(data))(*data)
+        try:
+            buffer = (ctypes.c_uint8 * len(data)).from_buffer(data)         # bytearray 等可写 buffer，不复制
+        except TypeError:
+            try:
+                buffer = (ctypes.c_uint8 * len(data)).from_buffer_copy(data)    # bytes、只读 memoryview
+            except TypeError:
+                buffer = (ctypes.c_uint8 * len(data))(*data)                # list
 
         self.jlk.JLINKARM_WriteMem(addr, len(data), buffer)
 
     def write_mem_U32(self, addr, data):
         buffer = (ctypes.c_uint32 * len(data))(*data)
 
-        self.write_mem_U8(addr, bytes(buffer))  # MCU and PC both little-endian
+        self.jlk.JLINKARM_WriteMem(addr, len(data) * 4, buffer)  # MCU and PC both little-endian
 
     def read_mem_U8(self, addr, count):
         buffer = (ctypes.c_uint8 * count)()
@@ -70,6 +76,10 @@ class JLink(object):
 
         return buffer[:]
 
+    def read_mem_into(self, addr, buff):
+        buffer = (ctypes.c_uint8 * len(buff)).from_buffer(buff)   # 直接读入 buff，不复制
+        self.jlk.JLINKARM_ReadMemU8(addr, len(buff), buffer, 0)
+
     def read_mem_U16(self, addr, count):
         buffer = (ctypes.c_uint16 * count)()
         self.jlk.JLINKARM_ReadMemU16(addr, count, buffer, 0)
@@ -114,6 +124,15 @@ class JLink(object):
     def write_reg(self, reg, val):
         self.jlk.JLINKARM_WriteReg(self.core_regs[reg], val)
 
+    def write_regs(self, regs):
+        regIndex = [self.core_regs[reg] for reg in regs]
+
+        regIndex  = (ctypes.c_uint32 * len(regIndex))(*regIndex)
+        regValue  = (ctypes.c_uint32 * len(regIndex))(*regs.values())
+        regStatus = (ctypes.c_uint8  * len(regIndex))()
+
+        self.jlk.JLINKARM_WriteRegs(regIndex, regValue, regStatus, len(regIndex))
+
     def reset(self):
         self.jlk.JLINKARM_Reset()
 
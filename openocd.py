@@ -141,6 +141,9 @@ class OpenOCD:
     def write_reg(self, reg, val):
         self._exec(f'reg {self.core_regs[reg]} {val:#x}')
 
+    def write_regs(self, regs):
+        self._exec('; '.join([f'reg {self.core_regs[reg]} {val:#x}' for reg, val in regs.items()]))   # 一次 RPC 执行多条命令
+
     # halt: immediately halt after reset
     def reset(self, halt=False):
         self._exec(f'reset {"halt" if halt else "run"}')
@@ -103,6 +103,16 @@ class MemoryInterface(object):
 
         return res
 
+    ## @brief Read a block of aligned halfwords in memory.
+    # @return an array of halfword values
+    def read_memory_block16(self, addr, size):
+        return [self.read16(addr + i * 2) for i in range(size)]
+
+    ## @brief Write a block of aligned halfwords in memory.
+    def write_memory_block16(self, addr, data):
+        for i, h in enumerate(data):
+            self.write16(addr + i * 2, h)
+
     ## @brief Write a block of unaligned bytes in memory.
     def write_memory_block8(self, addr, data):
         size = len(data)
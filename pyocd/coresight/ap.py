@@ -88,6 +88,7 @@ CSW_MSTRDBG  =  0x20000000
 CSW_RESERVED =  0x01000000
 
 CSW_VALUE = (CSW_RESERVED | CSW_MSTRDBG | CSW_HPROT | CSW_DBGSTAT | CSW_SADDRINC)
+CSW_VALUE_PACKED = (CSW_VALUE & ~CSW_ADDRINC) | CSW_PADDRINC
 
 TRANSFER_SIZE = {8: CSW_SIZE8,
                  16: CSW_SIZE16,
@@ -183,6 +184,9 @@ class MEM_AP(AccessPort, memory_interface.MemoryInterface):
         ## Cached CSW value.
         self._csw = -1
 
+        ## Whether the AP supports packed 8- and 16-bit transfers. Set by init().
+        self.has_packed = False
+
         # Default to the smallest size supported by all targets.
         # A size smaller than the supported size will decrease performance
         # due to the extra address writes, but will not create any
@@ -204,6 +208,29 @@ class MEM_AP(AccessPort, memory_interface.MemoryInterface):
             self.read_memory = self._read_memory
             self.write_memory_block32 = self._write_memory_block32
             self.read_memory_block32 = self._read_memory_block32
+            self.write_memory_block8 = self._write_memory_block8
+            self.read_memory_block8 = self._read_memory_block8
+            self.write_memory_block16 = self._write_memory_block16
+            self.read_memory_block16 = self._read_memory_block16
+
+    def init(self):
+        super(MEM_AP, self).init()
+        self._init_packed()
+
+    ## @brief Determine whether the AP supports packed transfers.
+    #
+    # CSW.AddrInc only reads back as packed, and CSW.Size as 16-bit, if the AP implements
+    # them, so write that setting and check what the AP kept.
+    def _init_packed(self):
+        try:
+            self.write_reg(MEM_AP_CSW, CSW_VALUE_PACKED | CSW_SIZE16)
+            csw = super(MEM_AP, self).read_reg(MEM_AP_CSW)
+            self.has_packed = (csw & (CSW_ADDRINC | CSW_SIZE)) == (CSW_PADDRINC | CSW_SIZE16)
+        except exceptions.Error:
+            self.has_packed = False
+        # The cached CSW may not match what the AP actually kept.
+        self._csw = -1
+        logging.debug("AP#%d packed transfers %ssupported", self.ap_num, "" if self.has_packed else "not ")
 
     def read_reg(self, addr, now=True):
         ap_regaddr = addr & APREG_MASK
@@ -393,6 +420,179 @@ class MEM_AP(AccessPort, memory_interface.MemoryInterface):
             addr += n
         return resp
 
+    ## @brief Write a single transaction's worth of 8- or 16-bit values.
+    #
+    # Without packing each DRW access carries one value on its byte lanes. With packing
+    # each DRW access carries a whole word of values, so addr and the data must cover
+    # whole words. The transaction must not cross the MEM-AP's auto-increment boundary.
+    def _write_block_sized(self, addr, data, transfer_size, packed=False):
+        unit = transfer_size // 8
+        assert (addr & (unit - 1)) == 0
+        num = self.dp.next_access_number
+        if LOG_DAP:
+            self.logger.info("_write_block%d:%06d (addr=0x%08x, size=%d%s) {", transfer_size, num, addr, len(data), ", packed" if packed else "")
+        if packed:
+            assert (addr & 0x3) == 0 and (len(data) * unit) & 0x3 == 0
+            csw = CSW_VALUE_PACKED | TRANSFER_SIZE[transfer_size]
+            per_word = 4 // unit
+            words = [sum(data[i + j] << (j * transfer_size) for j in range(per_word))
+                        for i in range(0, len(data), per_word)]
+        else:
+            csw = CSW_VALUE | TRANSFER_SIZE[transfer_size]
+            words = [v << (((addr + i * unit) & 0x3) << 3) for i, v in enumerate(data)]
+        self.write_reg(MEM_AP_CSW, csw)
+        self.write_reg(MEM_AP_TAR, addr)
+        try:
+            self.link.write_ap_multiple((self.ap_num << APSEL_SHIFT) | MEM_AP_DRW, words)
+        except exceptions.TransferFaultError as error:
+            # Annotate error with target address.
+            self._handle_error(error, num)
+            error.fault_address = addr
+            error.fault_length = len(data) * unit
+            raise
+        except exceptions.Error as error:
+            self._handle_error(error, num)
+            raise
+        if LOG_DAP:
+            self.logger.info("_write_block%d:%06d }", transfer_size, num)
+
+    ## @brief Read a single transaction's worth of 8- or 16-bit values.
+    #
+    # The same packing rules as _write_block_sized() apply.
+    # @return An array of values, or a callback returning it if @a now is False.
+    def _read_block_sized(self, addr, size, transfer_size, packed=False, now=True):
+        unit = transfer_size // 8
+        assert (addr & (unit - 1)) == 0
+        num = self.dp.next_access_number
+        if LOG_DAP:
+            self.logger.info("_read_block%d:%06d (addr=0x%08x, size=%d%s) {", transfer_size, num, addr, size, ", packed" if packed else "")
+        if packed:
+            assert (addr & 0x3) == 0 and (size * unit) & 0x3 == 0
+            csw = CSW_VALUE_PACKED | TRANSFER_SIZE[transfer_size]
+            count = size * unit // 4
+        else:
+            csw = CSW_VALUE | TRANSFER_SIZE[transfer_size]
+            count = size
+        mask = (1 << transfer_size) - 1
+        try:
+            self.write_reg(MEM_AP_CSW, csw)
+            self.write_reg(MEM_AP_TAR, addr)
+            result_cb = self.link.read_ap_multiple((self.ap_num << APSEL_SHIFT) | MEM_AP_DRW, count, now=False)
+        except exceptions.TransferFaultError as error:
+            # Annotate error with target address.
+            self._handle_error(error, num)
+            error.fault_address = addr
+            error.fault_length = size * unit
+            raise
+        except exceptions.Error as error:
+            self._handle_error(error, num)
+            raise
+
+        def read_block_cb():
+            try:
+                resp = result_cb()
+            except exceptions.TransferFaultError as error:
+                # Annotate error with target address.
+                self._handle_error(error, num)
+                error.fault_address = addr
+                error.fault_length = size * unit
+                raise
+            except exceptions.Error as error:
+                self._handle_error(error, num)
+                raise
+            if packed:
+                res = [(w >> shift) & mask for w in resp for shift in range(0, 32, transfer_size)]
+            else:
+                res = [(w >> (((addr + i * unit) & 0x3) << 3)) & mask for i, w in enumerate(resp)]
+            if LOG_DAP:
+                self.logger.info("_read_block%d:%06d }", transfer_size, num)
+            return res
+
+        if now:
+            return read_block_cb()
+        else:
+            return read_block_cb
+
+    ## @brief Split a run of 8- or 16-bit values into sized transactions.
+    #
+    # Transactions never cross the auto-increment boundary. If @a packed is True, the
+    # values up to the first word boundary get their own transaction, whole words are
+    # transferred packed and any values left over in the last word get a final transaction.
+    # @return A list of (addr, index, count, packed) tuples, index being the position of
+    #   the first value of the transaction in the run.
+    def _split_sized(self, addr, size, transfer_size, packed):
+        unit = transfer_size // 8
+        per_word = 4 // unit
+        chunks = []
+        idx = 0
+        while size > 0:
+            n = min(size, (self.auto_increment_page_size - (addr & (self.auto_increment_page_size - 1))) // unit)
+            pack = False
+            if packed:
+                if addr & 0x3:
+                    n = min(n, ((-addr) & 0x3) // unit)
+                elif n >= per_word:
+                    n -= n % per_word
+                    pack = True
+            chunks.append((addr, idx, n, pack))
+            size -= n
+            idx += n
+            addr += n * unit
+        return chunks
+
+    ## @brief Write a block of unaligned bytes in memory.
+    #
+    # The unaligned head and tail are each written with one auto-incrementing byte
+    # transaction, and the aligned middle as words.
+    def _write_memory_block8(self, addr, data):
+        size = len(data)
+        head = min(size, (-addr) & 0x3)
+        middle = (size - head) & ~0x3
+        if head:
+            self._write_block_sized(addr, data[:head], 8)
+        if middle:
+            self._write_memory_block32(addr + head, conversion.byte_list_to_u32le_list(data[head:head + middle]))
+        if size - head - middle:
+            self._write_block_sized(addr + head + middle, data[head + middle:], 8)
+
+    ## @brief Read a block of unaligned bytes in memory.
+    #
+    # The head and tail reads are queued around the aligned word reads so they share
+    # round trips with them.
+    # @return An array of byte values
+    def _read_memory_block8(self, addr, size):
+        head = min(size, (-addr) & 0x3)
+        middle = (size - head) & ~0x3
+        head_cb = self._read_block_sized(addr, head, 8, now=False) if head else None
+        words = self._read_memory_block32(addr + head, middle // 4) if middle else []
+        tail_cb = self._read_block_sized(addr + head + middle, size - head - middle, 8, now=False) if size - head - middle else None
+
+        res = head_cb() if head_cb else []
+        res += conversion.u32le_list_to_byte_list(words)
+        if tail_cb:
+            res += tail_cb()
+        return res
+
+    ## @brief Write a block of aligned halfwords in memory.
+    #
+    # Halfword accesses are kept, so this is also usable for 16-bit peripheral registers.
+    def _write_memory_block16(self, addr, data):
+        assert (addr & 0x1) == 0
+        for a, i, n, pack in self._split_sized(addr, len(data), 16, self.has_packed):
+            self._write_block_sized(a, data[i:i + n], 16, pack)
+
+    ## @brief Read a block of aligned halfwords in memory.
+    #
+    # @return An array of halfword values
+    def _read_memory_block16(self, addr, size):
+        assert (addr & 0x1) == 0
+        cbs = [self._read_block_sized(a, n, 16, pack, now=False)
+                    for a, i, n, pack in self._split_sized(addr, size, 16, self.has_packed)]
+        res = []
+        for cb in cbs:
+            res += cb()
+        return res
+
     def _handle_error(self, error, num):
         self.dp._handle_error(error, num)
         self._csw = -1
@@ -637,6 +637,20 @@ class CortexM(Target, CoreSightComponent):
         """
         self.ap.write_memory_block8(addr, data)
 
+    def read_memory_block16(self, addr, size):
+        """
+        read a block of aligned halfwords in memory. Returns
+        an array of halfword values
+        """
+        data = self.ap.read_memory_block16(addr, size)
+        return self.bp_manager.filter_memory_aligned_16(addr, size, data)
+
+    def write_memory_block16(self, addr, data):
+        """
+        write a block of aligned halfwords in memory.
+        """
+        self.ap.write_memory_block16(addr, data)
+
     def write_memory_block32(self, addr, data):
         """
         write a block of aligned words in memory.
@@ -953,18 +967,23 @@ class CortexM(Target, CoreSightComponent):
     def is_halted(self):
         return self.get_state() == Target.TARGET_HALTED
 
-    def resume(self):
+    def resume(self, now=True):
         """
         resume the execution
+
+        With now=False the caller guarantees that the core is halted, and the
+        DHCSR write is left queued with any other deferred transfers instead of
+        being flushed.
         """
-        if self.get_state() != Target.TARGET_HALTED:
+        if now and self.get_state() != Target.TARGET_HALTED:
             logging.debug('cannot resume: target not halted')
             return
         self.notify(Notification(event=Target.EVENT_PRE_RUN, source=self, data=Target.RUN_TYPE_RESUME))
         self._run_token += 1
         self.clear_debug_cause_bits()
         self.write_memory(CortexM.DHCSR, CortexM.DBGKEY | CortexM.C_DEBUGEN)
-        self.flush()
+        if now:
+            self.flush()
         self.notify(Notification(event=Target.EVENT_POST_RUN, source=self, data=Target.RUN_TYPE_RESUME))
 
     def find_breakpoint(self, addr):
@@ -1101,13 +1120,16 @@ class CortexM(Target, CoreSightComponent):
         """
         self.write_core_registers_raw([reg], [data])
 
-    def write_core_registers_raw(self, reg_list, data_list):
+    def write_core_registers_raw(self, reg_list, data_list, now=True):
         """
         Write one or more core registers
 
         Write core registers in reg_list with the associated value in
         data_list.  If any register in reg_list is a string, find the number
         associated to this register in the lookup table CORE_REGISTER.
+
+        With now=False the writes are left queued, and a callback is returned
+        that checks they completed once the transfers have been flushed.
         """
         assert len(reg_list) == len(data_list)
         # convert to index only
@@ -1171,9 +1193,15 @@ class CortexM(Target, CoreSightComponent):
 
         # Make sure S_REGRDY was set for all register
         # writes
-        for dhcsr_cb in dhcsr_cb_list:
-            dhcsr_val = dhcsr_cb()
-            assert dhcsr_val & CortexM.S_REGRDY
+        def write_core_registers_cb():
+            for dhcsr_cb in dhcsr_cb_list:
+                dhcsr_val = dhcsr_cb()
+                assert dhcsr_val & CortexM.S_REGRDY
+
+        if now:
+            write_core_registers_cb()
+        else:
+            return write_core_registers_cb
 
     ## @brief Set a hardware or software breakpoint at a specific location in memory.
     #
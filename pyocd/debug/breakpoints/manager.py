@@ -158,6 +158,12 @@ class BreakpointManager(object):
                 data[i] = provider.filter_memory(addr + i, 8, d)
         return data
 
+    def filter_memory_aligned_16(self, addr, size, data):
+        for provider in [p for p in self._providers.values() if p.do_filter_memory]:
+            for i, d in enumerate(data):
+                data[i] = provider.filter_memory(addr + i * 2, 16, d)
+        return data
+
     def filter_memory_aligned_32(self, addr, size, data):
         for provider in [p for p in self._providers.values() if p.do_filter_memory]:
             for i, d in enumerate(data):
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import array
+import contextlib
 from .dap_access_api import DAPAccessIntf
 
 class Command:
@@ -111,10 +112,119 @@ DAP_TRANSFER_WAIT = 2
 DAP_TRANSFER_FAULT = 4
 DAP_TRANSFER_NO_ACK = 7
 
+# Commands that can be batched into DAP_ExecuteCommands, and the length of their response.
+# Each response is only the command ID, a DAP_OK status and for DAP_ResetTarget an execute
+# byte, so the command can be answered successfully before it has run.
+BATCH_RESPONSE_LENGTH = {
+    Command.DAP_LED: 2,
+    Command.DAP_DISCONNECT: 2,
+    Command.DAP_TRANSFER_CONFIGURE: 2,
+    Command.DAP_WRITE_ABORT: 2,
+    Command.DAP_RESET_TARGET: 3,
+    Command.DAP_SWJ_CLOCK: 2,
+    Command.DAP_SWJ_SEQUENCE: 2,
+    Command.DAP_SWD_CONFIGURE: 2,
+    Command.DAP_JTAG_CONFIGURE: 2,
+    Command.DAP_SWO_TRANSPORT: 2,
+    Command.DAP_SWO_MODE: 2,
+    Command.DAP_SWO_CONTROL: 2,
+    }
+
 ## @brief This class implements the CMSIS-DAP wire protocol.
 class CMSISDAPProtocol(object):
     def __init__(self, interface):
         self.interface = interface
+        # Commands queued by batch(), or None when not batching.
+        self._batch = None
+        # Whether the probe supports DAP_ExecuteCommands, or None if not yet known.
+        self._has_execute_commands = None
+
+    def _command(self, cmd):
+        """! @brief Send a command and return its response.
+
+        While batching, commands listed in BATCH_RESPONSE_LENGTH are queued and get a
+        successful response right away. Any other command sends the queued ones first.
+        """
+        if self._batch is not None:
+            length = BATCH_RESPONSE_LENGTH.get(cmd[0])
+            if length is not None:
+                self._batch.append(cmd)
+                return [cmd[0], DAP_OK, 0][:length]
+            self._send_batch()
+
+        self.interface.write(cmd)
+        return self.interface.read()
+
+    def has_execute_commands(self):
+        """! @brief Whether the probe supports DAP_ExecuteCommands.
+
+        Firmware that doesn't know the command answers with DAP_ERROR (ID_DAP_Invalid)
+        instead of echoing it.
+        """
+        if self._has_execute_commands is None:
+            self.interface.write([Command.DAP_EXECUTE_COMMANDS, 0])
+            resp = self.interface.read()
+            self._has_execute_commands = (resp[0] == Command.DAP_EXECUTE_COMMANDS)
+        return self._has_execute_commands
+
+    @contextlib.contextmanager
+    def batch(self):
+        """! @brief Send the control commands issued in the body in as few packets as possible.
+
+        The commands are packed into DAP_ExecuteCommands packets that are sent when the
+        body exits, or earlier when a command that needs its real response is issued.
+        Errors of batched commands are raised at that point. On firmware without
+        DAP_ExecuteCommands, or when already batching, commands are sent one by one.
+        """
+        if self._batch is not None or not self.has_execute_commands():
+            yield
+            return
+
+        self._batch = []
+        try:
+            yield
+            self._send_batch()
+        finally:
+            self._batch = None
+
+    def _send_batch(self):
+        cmds, self._batch = self._batch, []
+
+        # Pack the commands into DAP_ExecuteCommands packets, noting the command IDs of each.
+        packets = []
+        for cmd in cmds:
+            if not packets or len(packets[-1][0]) + len(cmd) > self.interface.packet_size or len(packets[-1][1]) == 0xff:
+                packets.append(([Command.DAP_EXECUTE_COMMANDS, 0], []))
+            packet, ids = packets[-1]
+            packet[1] += 1
+            packet.extend(cmd)
+            ids.append(cmd[0])
+
+        # Up to packet_count packets are in flight at a time, like for DAP_Transfer. All the
+        # responses of a group are read before checking them so none is left behind.
+        packet_count = self.interface.get_packet_count()
+        for i in range(0, len(packets), packet_count):
+            group = packets[i:i + packet_count]
+            for packet, ids in group:
+                self.interface.write(packet)
+
+            resps = [self.interface.read() for _ in group]
+            for resp, (packet, ids) in zip(resps, group):
+                if resp[0] != Command.DAP_EXECUTE_COMMANDS or resp[1] != len(ids):
+                    # Response is to a different command
+                    raise DAPAccessIntf.DeviceError()
+
+                pos = 2
+                for cmd_id in ids:
+                    if resp[pos] != cmd_id:
+                        # Response is to a different command
+                        raise DAPAccessIntf.DeviceError()
+
+                    if resp[pos + 1] != DAP_OK:
+                        # Batched command failed
+                        raise DAPAccessIntf.CommandError()
+
+                    pos += BATCH_RESPONSE_LENGTH[cmd_id]
 
     def dap_info(self, id_):
         assert type(id_) is DAPAccessIntf.ID
@@ -122,9 +232,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_INFO)
         cmd.append(id_.value)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_INFO:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -152,9 +260,7 @@ class CMSISDAPProtocol(object):
         cmd.append(Command.DAP_LED)
         cmd.append(type)
         cmd.append(int(enabled))
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_LED:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -169,9 +275,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_CONNECT)
         cmd.append(mode)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_CONNECT:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -185,9 +289,7 @@ class CMSISDAPProtocol(object):
     def disconnect(self):
         cmd = []
         cmd.append(Command.DAP_DISCONNECT)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_DISCONNECT:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -206,9 +308,7 @@ class CMSISDAPProtocol(object):
         cmd.append((data >> 8) & 0xff)
         cmd.append((data >> 16) & 0xff)
         cmd.append((data >> 24) & 0xff)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_WRITE_ABORT:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -222,9 +322,7 @@ class CMSISDAPProtocol(object):
     def reset_target(self):
         cmd = []
         cmd.append(Command.DAP_RESET_TARGET)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_RESET_TARGET:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -243,9 +341,7 @@ class CMSISDAPProtocol(object):
         cmd.append(wait_retry >> 8)
         cmd.append(match_retry & 0xff)
         cmd.append(match_retry >> 8)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_TRANSFER_CONFIGURE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -264,9 +360,7 @@ class CMSISDAPProtocol(object):
         cmd.append((clock >> 8) & 0xff)
         cmd.append((clock >> 16) & 0xff)
         cmd.append((clock >> 24) & 0xff)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWJ_CLOCK:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -286,9 +380,7 @@ class CMSISDAPProtocol(object):
         cmd.append((wait >> 8) & 0xff)
         cmd.append((wait >> 16) & 0xff)
         cmd.append((wait >> 24) & 0xff)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWJ_PINS:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -299,9 +391,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_SWD_CONFIGURE)
         cmd.append(conf)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWD_CONFIGURE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -318,9 +408,7 @@ class CMSISDAPProtocol(object):
         cmd.append(len(data) * 8)
         for i in range(len(data)):
             cmd.append(data[i])
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWJ_SEQUENCE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -337,9 +425,7 @@ class CMSISDAPProtocol(object):
         cmd.append(1)
         cmd.append(info)
         cmd.append(tdi)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_JTAG_SEQUENCE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -355,9 +441,7 @@ class CMSISDAPProtocol(object):
         cmd.append(Command.DAP_JTAG_CONFIGURE)
         cmd.append(dev_num)
         cmd.append(irlen)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_JTAG_CONFIGURE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -372,9 +456,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_JTAG_IDCODE)
         cmd.append(index)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_JTAG_IDCODE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -392,9 +474,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_SWO_TRANSPORT)
         cmd.append(transport)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_TRANSPORT:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -409,9 +489,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_SWO_MODE)
         cmd.append(mode)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_MODE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -429,9 +507,7 @@ class CMSISDAPProtocol(object):
         cmd.append((baudrate >> 8) & 0xff)
         cmd.append((baudrate >> 16) & 0xff)
         cmd.append((baudrate >> 24) & 0xff)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_BAUDRATE:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -445,9 +521,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_SWO_CONTROL)
         cmd.append(action)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_CONTROL:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -461,9 +535,7 @@ class CMSISDAPProtocol(object):
     def swo_status(self):
         cmd = []
         cmd.append(Command.DAP_SWO_STATUS)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_STATUS:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -480,9 +552,7 @@ class CMSISDAPProtocol(object):
         cmd.append(Command.DAP_SWO_DATA)
         cmd.append(count & 0xff)
         cmd.append((count >> 8) & 0xff)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
         if resp[0] != Command.DAP_SWO_DATA:
             # Response is to a different command
             raise DAPAccessIntf.DeviceError()
@@ -500,9 +570,7 @@ class CMSISDAPProtocol(object):
         cmd = []
         cmd.append(Command.DAP_VENDOR0 + index)
         cmd.extend(data)
-        self.interface.write(cmd)
-
-        resp = self.interface.read()
+        resp = self._command(cmd)
 
         if resp[0] != Command.DAP_VENDOR0 + index:
             # Response is to a different command
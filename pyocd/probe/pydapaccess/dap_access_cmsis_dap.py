@@ -18,6 +18,7 @@
 import re
 import logging
 import time
+import struct
 import collections
 import six
 from .dap_settings import DAPSettings
@@ -111,12 +112,7 @@ class _Transfer(object):
         that get_data_size returns.
         """
         assert len(data) == self._size_bytes
-        result = []
-        for i in range(0, self._size_bytes, 4):
-            word = ((data[0 + i] << 0) | (data[1 + i] << 8) |
-                    (data[2 + i] << 16) | (data[3 + i] << 24))
-            result.append(word)
-        self._result = result
+        self._result = list(struct.unpack('<%dI' % (self._size_bytes // 4), data))
 
     def add_error(self, error):
         """
@@ -292,29 +288,22 @@ class _Command(object):
         assert self.get_empty() is False
         buf = bytearray(self._size)
         transfer_count = self._read_count + self._write_count
-        pos = 0
-        buf[pos] = Command.DAP_TRANSFER
-        pos += 1
-        buf[pos] = self._dap_index
-        pos += 1
-        buf[pos] = transfer_count
-        pos += 1
+        struct.pack_into('<BBB', buf, 0, Command.DAP_TRANSFER, self._dap_index, transfer_count)
+        pos = 3
         for count, request, write_list in self._data:
-            assert write_list is None or len(write_list) <= count
-            write_pos = 0
-            for _ in range(count):
-                buf[pos] = request
-                pos += 1
-                if not request & READ:
-                    buf[pos] = (write_list[write_pos] >> (8 * 0)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 1)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 2)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 3)) & 0xff
-                    pos += 1
-                    write_pos += 1
+            assert write_list is None or len(write_list) == count
+            if request & READ:
+                buf[pos:pos + count] = bytes((request,)) * count
+                pos += count
+            else:
+                # Each transfer is a request byte followed by a word. Pack the words in
+                # one call, then interleave the request bytes using strided slice copies.
+                words = struct.pack('<%dI' % count, *write_list)
+                end = pos + 5 * count
+                buf[pos:end:5] = bytes((request,)) * count
+                for i in range(4):
+                    buf[pos + 1 + i:end:5] = words[i::4]
+                pos = end
         return buf
 
     def _decode_transfer_data(self, data):
@@ -341,7 +330,7 @@ class _Command(object):
         if data[1] != self._read_count + self._write_count:
             raise DAPAccessIntf.TransferError()
 
-        return data[3:3 + 4 * self._read_count]
+        return memoryview(data)[3:3 + 4 * self._read_count]
 
     def _encode_transfer_block_data(self):
         """
@@ -355,32 +344,15 @@ class _Command(object):
         transfer_count = self._read_count + self._write_count
         assert not (self._read_count != 0 and self._write_count != 0)
         assert self._block_request is not None
-        pos = 0
-        buf[pos] = Command.DAP_TRANSFER_BLOCK
-        pos += 1
-        buf[pos] = self._dap_index
-        pos += 1
-        buf[pos] = transfer_count & 0xff
-        pos += 1
-        buf[pos] = (transfer_count >> 8) & 0xff
-        pos += 1
-        buf[pos] = self._block_request
-        pos += 1
+        struct.pack_into('<BBHB', buf, 0, Command.DAP_TRANSFER_BLOCK, self._dap_index,
+                         transfer_count, self._block_request)
+        pos = 5
         for count, request, write_list in self._data:
-            assert write_list is None or len(write_list) <= count
+            assert write_list is None or len(write_list) == count
             assert request == self._block_request
-            write_pos = 0
             if not request & READ:
-                for _ in range(count):
-                    buf[pos] = (write_list[write_pos] >> (8 * 0)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 1)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 2)) & 0xff
-                    pos += 1
-                    buf[pos] = (write_list[write_pos] >> (8 * 3)) & 0xff
-                    pos += 1
-                    write_pos += 1
+                struct.pack_into('<%dI' % count, buf, pos, *write_list)
+                pos += 4 * count
         return buf
 
     def _decode_transfer_block_data(self, data):
@@ -408,7 +380,7 @@ class _Command(object):
         if transfer_count != self._read_count + self._write_count:
             raise DAPAccessIntf.TransferError()
 
-        return data[4:4 + 4 * self._read_count]
+        return memoryview(data)[4:4 + 4 * self._read_count]
 
     def encode_data(self):
         """
@@ -665,24 +637,26 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         assert isinstance(port, DAPAccessIntf.PORT)
         actual_port = self._protocol.connect(port.value)
         self._dap_port = DAPAccessIntf.PORT(actual_port)
-        # set clock frequency
-        self._protocol.set_swj_clock(self._frequency)
-        # configure transfer
-        self._protocol.transfer_configure()
+        with self._protocol.batch():
+            # set clock frequency
+            self._protocol.set_swj_clock(self._frequency)
+            # configure transfer
+            self._protocol.transfer_configure()
 
     def swj_sequence(self):
-        if self._dap_port == DAPAccessIntf.PORT.SWD:
-            # configure swd protocol
-            self._protocol.swd_configure()
-            # switch from jtag to swd
-            self._jtag_to_swd()
-        elif self._dap_port == DAPAccessIntf.PORT.JTAG:
-            # configure jtag protocol
-            self._protocol.jtag_configue(4)
-            # Test logic reset, run test idle
-            self._protocol.swj_sequence([0x1F])
-        else:
-            assert False
+        with self._protocol.batch():
+            if self._dap_port == DAPAccessIntf.PORT.SWD:
+                # configure swd protocol
+                self._protocol.swd_configure()
+                # switch from jtag to swd
+                self._jtag_to_swd()
+            elif self._dap_port == DAPAccessIntf.PORT.JTAG:
+                # configure jtag protocol
+                self._protocol.jtag_configue(4)
+                # Test logic reset, run test idle
+                self._protocol.swj_sequence([0x1F])
+            else:
+                assert False
 
     def disconnect(self):
         self.flush()
@@ -873,19 +847,22 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         cmd = self._commands_to_read.popleft()
         try:
             raw_data = self._interface.read()
-            raw_data = bytearray(raw_data)
+            if not isinstance(raw_data, (bytes, bytearray)):
+                raw_data = bytearray(raw_data)
             decoded_data = cmd.decode_data(raw_data)
         except Exception as exception:
             self._abort_all_transfers(exception)
             raise
 
-        decoded_data = bytearray(decoded_data)
-        self._command_response_buf.extend(decoded_data)
+        # Only data left over from the previous packet (a transfer spanning packets)
+        # has to be copied; otherwise transfers get memoryview slices of the packet.
+        if len(self._command_response_buf):
+            decoded_data = memoryview(self._command_response_buf + decoded_data)
 
         # Attach data to transfers
         pos = 0
         while True:
-            size_left = len(self._command_response_buf) - pos
+            size_left = len(decoded_data) - pos
             if size_left == 0:
                 # If size left is 0 then the transfer list might
                 # be empty, so don't try to access element 0
@@ -896,13 +873,12 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
                 break
 
             self._transfer_list.popleft()
-            data = self._command_response_buf[pos:pos + size]
+            data = decoded_data[pos:pos + size]
             pos += size
             transfer.add_response(data)
 
-        # Remove used data from _command_response_buf
-        if pos > 0:
-            self._command_response_buf = self._command_response_buf[pos:]
+        # Keep unused data for the next packet
+        self._command_response_buf = bytearray(decoded_data[pos:])
 
     def _send_packet(self):
         """
@@ -922,7 +898,7 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
             self._read_packet()
         data = cmd.encode_data()
         try:
-            self._interface.write(list(data))
+            self._interface.write(data)
         except Exception as exception:
             self._abort_all_transfers(exception)
             raise
@@ -1016,3 +992,49 @@ class DAPAccessCMSISDAP(DAPAccessIntf):
         if isinstance(exception, DAPAccessIntf.TransferError):
             for _ in range(pending_reads):
                 self._interface.read()
+
+
+if __name__ == '__main__':
+    # Micro-benchmark for the DAP_Transfer/DAP_TransferBlock packet encoder and decoder:
+    #   python -m pyocd.probe.pydapaccess.dap_access_cmsis_dap
+    import timeit
+
+    PACKET_SIZE = 512
+    DRW = AP_ACC | 0x0C     # MEM-AP DRW register
+    TAR = AP_ACC | 0x04     # MEM-AP TAR register
+
+    def bench(name, func, count, number=2000):
+        elapsed = timeit.timeit(func, number=number) / number
+        print("%-32s %8.2f us/packet %8.2f MB/s" % (name, elapsed * 1e6, count * 4 / elapsed / 1e6))
+
+    block_count = (PACKET_SIZE - 5) // 4
+    block_words = list(range(block_count))
+
+    def encode_block_write():
+        cmd = _Command(PACKET_SIZE)
+        cmd.add(block_count, DRW | WRITE, block_words, 0)
+        cmd.encode_data()
+
+    transfer_count = (PACKET_SIZE - 3) // 5 - 1
+    transfer_words = list(range(transfer_count))
+
+    def encode_transfer_write():
+        cmd = _Command(PACKET_SIZE)
+        cmd.add(1, TAR | WRITE, [0x20000000], 0)
+        cmd.add(transfer_count, DRW | WRITE, transfer_words, 0)
+        cmd.encode_data()
+
+    read_count = (PACKET_SIZE - 4) // 4
+    read_cmd = _Command(PACKET_SIZE)
+    read_cmd.add(read_count, DRW | READ, None, 0)
+    read_cmd.encode_data()
+    read_response = bytearray(struct.pack('<BHB', Command.DAP_TRANSFER_BLOCK, read_count, DAP_TRANSFER_OK))
+    read_response += struct.pack('<%dI' % read_count, *range(read_count))
+
+    def decode_block_read():
+        transfer = _Transfer(None, 0, read_count, DRW | READ, None)
+        transfer.add_response(read_cmd.decode_data(read_response))
+
+    bench("encode DAP_TransferBlock write", encode_block_write, block_count)
+    bench("encode DAP_Transfer write", encode_transfer_write, transfer_count)
+    bench("decode DAP_TransferBlock read", decode_block_read, read_count)
@@ -20,8 +20,8 @@ from ..dap_access_api import DAPAccessIntf
 import logging
 import os
 import threading
+import collections
 import six
-from time import sleep
 import platform
 import errno
 
@@ -56,7 +56,8 @@ class PyUSB(Interface):
         self.kernel_driver_was_attached = False
         self.closed = True
         self.thread = None
-        self.rcv_data = []
+        self.rcv_data = collections.deque()
+        self.rcv_cond = threading.Condition()
         self.read_sem = threading.Semaphore(0)
         self.packet_size = 64
 
@@ -144,10 +145,15 @@ class PyUSB(Interface):
             while not self.closed:
                 self.read_sem.acquire()
                 if not self.closed:
-                    self.rcv_data.append(self.ep_in.read(self.ep_in.wMaxPacketSize, 10 * 1000))
+                    data = self.ep_in.read(self.ep_in.wMaxPacketSize, 10 * 1000)
+                    with self.rcv_cond:
+                        self.rcv_data.append(data)
+                        self.rcv_cond.notify()
         finally:
             # Set last element of rcv_data to None on exit
-            self.rcv_data.append(None)
+            with self.rcv_cond:
+                self.rcv_data.append(None)
+                self.rcv_cond.notify()
 
     @staticmethod
     def get_all_connected_interfaces():
@@ -203,13 +209,15 @@ class PyUSB(Interface):
         """
         read data on the IN endpoint associated to the HID interface
         """
-        while len(self.rcv_data) == 0:
-            sleep(0)
+        # Block until the rx thread hands over a packet (or exits)
+        with self.rcv_cond:
+            while len(self.rcv_data) == 0:
+                self.rcv_cond.wait()
 
-        if self.rcv_data[0] is None:
-            raise DAPAccessIntf.DeviceError("Device %s read thread exited" %
-                                            self.serial_number)
-        return self.rcv_data.pop(0)
+            if self.rcv_data[0] is None:
+                raise DAPAccessIntf.DeviceError("Device %s read thread exited" %
+                                                self.serial_number)
+            return self.rcv_data.popleft()
 
     def set_packet_count(self, count):
         # No interface level restrictions on count
@@ -232,7 +240,7 @@ class PyUSB(Interface):
         self.read_sem.release()
         self.thread.join()
         assert self.rcv_data[-1] is None
-        self.rcv_data = []
+        self.rcv_data = collections.deque()
         usb.util.release_interface(self.dev, self.intf_number)
         if self.kernel_driver_was_attached:
             try:
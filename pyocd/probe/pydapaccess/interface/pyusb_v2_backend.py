@@ -20,8 +20,8 @@ from ..dap_access_api import DAPAccessIntf
 import logging
 import os
 import threading
+import collections
 import six
-from time import sleep
 import errno
 import platform
 
@@ -56,7 +56,8 @@ class PyUSBv2(Interface):
         self.rx_stop_event = None
         self.swo_thread = None
         self.swo_stop_event = None
-        self.rcv_data = []
+        self.rcv_data = collections.deque()
+        self.rcv_cond = threading.Condition()
         self.swo_data = []
         self.read_sem = threading.Semaphore(0)
         self.packet_size = 512
@@ -147,10 +148,15 @@ class PyUSBv2(Interface):
             while not self.rx_stop_event.is_set():
                 self.read_sem.acquire()
                 if not self.rx_stop_event.is_set():
-                    self.rcv_data.append(self.ep_in.read(self.ep_in.wMaxPacketSize, 10 * 1000))
+                    data = self.ep_in.read(self.ep_in.wMaxPacketSize, 10 * 1000)
+                    with self.rcv_cond:
+                        self.rcv_data.append(data)
+                        self.rcv_cond.notify()
         finally:
             # Set last element of rcv_data to None on exit
-            self.rcv_data.append(None)
+            with self.rcv_cond:
+                self.rcv_data.append(None)
+                self.rcv_cond.notify()
 
     def swo_rx_task(self):
         try:
@@ -202,12 +208,14 @@ class PyUSBv2(Interface):
 
     def read(self):
         """! @brief Read data on the IN endpoint."""
-        while len(self.rcv_data) == 0:
-            sleep(0)
+        # Block until the rx thread hands over a packet (or exits)
+        with self.rcv_cond:
+            while len(self.rcv_data) == 0:
+                self.rcv_cond.wait()
 
-        if self.rcv_data[0] is None:
-            raise DAPAccessIntf.DeviceError("Device %s read thread exited unexpectedly" % self.serial_number)
-        return self.rcv_data.pop(0)
+            if self.rcv_data[0] is None:
+                raise DAPAccessIntf.DeviceError("Device %s read thread exited unexpectedly" % self.serial_number)
+            return self.rcv_data.popleft()
 
     def read_swo(self):
         # Accumulate all available SWO data.
@@ -240,7 +248,7 @@ class PyUSBv2(Interface):
         self.read_sem.release()
         self.thread.join()
         assert self.rcv_data[-1] is None
-        self.rcv_data = []
+        self.rcv_data = collections.deque()
         self.swo_data = []
         usb.util.release_interface(self.dev, self.intf_number)
         usb.util.dispose_resources(self.dev)
@@ -146,7 +146,7 @@ class PyWinUSB(Interface):
         for _ in range(self.packet_size - len(data)):
             data.append(0)
         #logging.debug("send: %s", data)
-        self.report.send([0] + data)
+        self.report.send([0] + list(data))
         return
 
 
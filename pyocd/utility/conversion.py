@@ -24,12 +24,17 @@ def byte_list_to_u32le_list(data, pad=0x00):
     If the length of the data list is not a multiple of 4, then the pad value is used
     for the additional required bytes.
     """
-    res = []
-    for i in range(len(data) // 4):
-        res.append(data[i * 4 + 0] |
-                   data[i * 4 + 1] << 8 |
-                   data[i * 4 + 2] << 16 |
-                   data[i * 4 + 3] << 24)
+    try:
+        # Buffer-protocol objects (bytes, bytearray, memoryview) are unpacked in one C call
+        # without first being converted to a list of ints.
+        res = list(struct.unpack_from('<%dI' % (len(data) // 4), data))
+    except TypeError:
+        res = []
+        for i in range(len(data) // 4):
+            res.append(data[i * 4 + 0] |
+                       data[i * 4 + 1] << 8 |
+                       data[i * 4 + 2] << 16 |
+                       data[i * 4 + 3] << 24)
     remainder = (len(data) % 4)
     if remainder != 0:
         padCount = 4 - remainder
@@ -38,6 +43,10 @@ def byte_list_to_u32le_list(data, pad=0x00):
 
 def u32le_list_to_byte_list(data):
     """! @brief Convert a word array into a byte array"""
+    try:
+        return list(struct.pack('<%dI' % len(data), *data))
+    except struct.error:
+        pass
     res = []
     for x in data:
         res.append((x >> 0) & 0xff)
@@ -2,6 +2,7 @@ import os
 import time
 import ctypes
 import operator
+import contextlib
 
 
 import jlink
@@ -12,6 +13,8 @@ class XLink(object):
     def __init__(self, xlk):
         self.xlk = xlk
 
+        self.deferred = None    # session() 中排队的寄存器写入，退出会话时检查是否完成
+
         if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
             self.reg_add_alias()
 
@@ -83,6 +86,11 @@ class XLink(object):
         else:
             return 'arm'
     
+    @property
+    def background_access(self):
+        ''' 内核运行时能否访问内存：ARM 通过 AHB-AP 访问，不需要停住内核；OpenOCD 读写内存前会先 halt 内核 '''
+        return self.mode.startswith('arm') and not isinstance(self.xlk, openocd.OpenOCD)
+    
     def write_U8(self, addr, val):
         if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
             self.xlk.write_U8(addr, val)
@@ -119,11 +127,18 @@ class XLink(object):
         else:
             return self.xlk.read_memory_block8(addr, count)
 
+    def read_mem_into(self, addr, buff):
+        ''' 读取 len(buff) 个字节到 buff（bytearray 或可写的 memoryview）中 '''
+        if isinstance(self.xlk, jlink.JLink):
+            self.xlk.read_mem_into(addr, buff)
+        else:
+            buff[:] = bytes(self.read_mem_U8(addr, len(buff)))
+
     def read_mem_U16(self, addr, count):
         if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
             return self.xlk.read_mem_U16(addr, count)
         else:
-            return [self.xlk.read16(addr+i*2) for i in range(count)]
+            return self.xlk.read_memory_block16(addr, count)
 
     def read_mem_U32(self, addr, count):
         if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
@@ -155,6 +170,82 @@ class XLink(object):
         else:
             self.xlk.write_core_register_raw(reg, val)
 
+    def write_regs(self, regs):
+        ''' regs: {reg: val}，在一次传输中写入多个寄存器 '''
+        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):
+            self.xlk.write_regs({reg.lower(): val for reg, val in regs.items()})
+        else:
+            if self.deferred is None:
+                self.xlk.write_core_registers_raw(list(regs.keys()), list(regs.values()))
+            else:
+                self.deferred.append(self.xlk.write_core_registers_raw(list(regs.keys()), list(regs.values()), now=False))
+
+    @contextlib.contextmanager
+    def session(self):
+        ''' DAPLink：会话中的 write_regs、写内存和 go() 都作为 deferred transfer 排队，退出会话时一起发送，
+            然后再检查寄存器是否写入成功；J-Link、OpenOCD 的调用本身就是同步的，会话不起作用 '''
+        if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)) or self.deferred is not None:
+            yield
+            return
+
+        self.deferred = []
+        try:
+            yield
+
+            self.xlk.flush()
+
+            for check in self.deferred:
+                try:
+                    check()
+                except AssertionError:
+                    raise Exception('core register write not finished')
+
+        finally:
+            self.deferred = None
+
+    def tune_speed(self, addr, size, speeds):
+        ''' DAPLink：从低到高依次尝试 speeds 中的时钟（KHz），每一档检查 DP IDCODE，并向 RAM [addr, addr+size) 写入测试图案再读回比较；
+            在第一个出错的时钟处停止，切回并返回最后一个可靠的时钟；返回时内核处于 halt 状态 '''
+        dp = self.xlk.ap.dp
+        idcode = dp.read_id_code()
+
+        words = size // 4
+        pattern = [(0x55AA33CC ^ i * 0x9E3779B9) & 0xFFFFFFFF for i in range(words)]  # 每个字都不同，地址错位也能发现
+
+        # 测试图案写在 RAM 中，先用最低时钟复位并停住内核，以免破坏正在运行的程序（及其外设、DMA）
+        dp.set_clock(min(speeds) * 1000)
+        self.reset_and_halt()
+
+        best = None
+        for speed in sorted(speeds):
+            dp.set_clock(speed * 1000)
+            try:
+                ok = dp.read_id_code() == idcode
+                if ok:
+                    self.write_mem_U32(addr, pattern)
+                    ok = self.read_mem_U32(addr, words) == pattern
+            except Exception:
+                ok = False
+
+            if not ok:
+                break
+
+            best = speed
+
+        else:
+            return best
+
+        if best is None:
+            raise Exception(f'no reliable SWD clock, {sorted(speeds)[0]} KHz failed')
+
+        # 出错后 SWD 可能已失去同步，用可靠的时钟重新初始化 DP
+        dp.set_clock(best * 1000)
+        dp.init()
+        dp.power_up_debug()
+        self.xlk.ap.reset_did_occur()
+
+        return best
+
     def reset(self):
         self.xlk.reset()
 
@@ -172,8 +263,10 @@ class XLink(object):
     def go(self):
         if isinstance(self.xlk, jlink.JLink):
             self.xlk.go()
-        else:
+        elif isinstance(self.xlk, openocd.OpenOCD) or self.deferred is None:
             self.xlk.resume()
+        else:   # session() 中内核必定是 halt 的，不必先读 DHCSR 检查，DHCSR 的写入留在队列中
+            self.xlk.resume(now=False)
 
     def halted(self):
         if isinstance(self.xlk, (jlink.JLink, openocd.OpenOCD)):